@@ -0,0 +1,158 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""The catalog of button actions: the special actions ratbagd knows with
+their labels, and the names of the keycodes for key actions. Lookups are
+plain dict accesses so they are cheap enough for every label refresh.
+
+This module doesn't need Gtk, the GUI builds its catalog from the
+combobox model in piper.ui so the labels match (and are translated),
+everything else uses the built-in list.
+
+The keycode tables are in piper.keycodes, generated at build time by
+tools/gen-keycodes.py from the kernel's input-event-codes.h. Without them,
+e.g. when running from a source tree where they weren't generated, keys are
+only known by their number and a warning says so.
+"""
+
+import sys
+
+# The special actions as in piper-btnmap-custommap-liststore, used when
+# there is no UI model
+SPECIALS = [
+    ("none", "None"),
+    ("doubleclick", "Doubleclick"),
+    ("wheel-left", "Wheel Left"),
+    ("wheel-right", "Wheel Right"),
+    ("wheel-up", "Wheel Up"),
+    ("wheel-down", "Wheel Down"),
+    ("ratchet-mode-switch", "Ratchet Mode Switch"),
+    ("resolution-cycle-up", "Resolution Cycle Up"),
+    ("resolution-up", "Resolution Up"),
+    ("resolution-down", "Resolution Down"),
+    ("resolution-alternate", "Resolution Switch"),
+    ("resolution-default", "Resolution Default"),
+    ("profile-cycle-up", "Profile Cycle Up"),
+    ("profile-up", "Profile Up"),
+    ("profile-down", "Profile Down"),
+    ("second-mode", "Second Mode"),
+    ("battery-level", "Battery Level"),
+]
+
+
+class ActionCatalog(object):
+    """Maps special action ids to their label and row in the UI model, and
+    keycodes to their names and back."""
+
+    def __init__(self, specials=SPECIALS):
+        """
+        @param specials A list of (id, label) tuples, in the order of the
+                        UI model
+        """
+        self._specials = list(specials)
+        self._labels = {}
+        self._rows = {}
+        for row, (special, label) in enumerate(self._specials):
+            self._labels.setdefault(special, label)
+            self._rows.setdefault(special, row)
+        self._keycodes = None
+        self._keynames = None
+        self._modifiers = None
+
+    @classmethod
+    def from_model(cls, model, label_column=0, id_column=1):
+        """Creates the catalog from a Gtk.TreeModel listing the special
+        actions, walking the model once."""
+        return cls([(row[id_column], row[label_column]) for row in model])
+
+    @property
+    def specials(self):
+        """The list of (id, label) tuples of all special actions."""
+        return self._specials
+
+    def special_label(self, special):
+        """Returns the label of the given special action id, or None if it
+        is unknown."""
+        return self._labels.get(special)
+
+    def special_row(self, special):
+        """Returns the row of the given special action id in the UI model,
+        or None if it is unknown."""
+        return self._rows.get(special)
+
+    def key_name(self, keycode):
+        """Returns the name of the given keycode, e.g. KEY_A for 30, or
+        the number as str if it is unknown."""
+        self._load_keycodes()
+        return self._keynames.get(keycode, str(keycode))
+
+    def key_label(self, keys):
+        """Returns the label of a key mapping, i.e. the keycode followed by
+        its modifiers, e.g. "KEY_LEFTCTRL+KEY_C" for [46, 29]."""
+        if len(keys) == 0:
+            return ""
+        return "+".join([self.key_name(k) for k in keys[1:]] + [self.key_name(keys[0])])
+
+    def is_modifier(self, keycode):
+        """Returns True if the keycode is one of a modifier key."""
+        self._load_keycodes()
+        return keycode in self._modifiers
+
+    def sort_modifiers(self, keycodes):
+        """Returns the given modifier keycodes in the order they are listed
+        in a key mapping."""
+        self._load_keycodes()
+        return [k for k in self._modifiers if k in keycodes]
+
+    @property
+    def has_keycodes(self):
+        """False if the generated piper.keycodes module is missing, i.e.
+        keys are only known by their number."""
+        self._load_keycodes()
+        return len(self._keycodes) > 0
+
+    def keycode(self, name):
+        """Returns the keycode with the given name, e.g. 30 for KEY_A, or
+        None if it is unknown. Numeric strings are returned as int."""
+        if name.isdigit():
+            return int(name)
+        self._load_keycodes()
+        return self._keycodes.get(name.upper())
+
+    def _load_keycodes(self):
+        # Only imported on first use, most label refreshes don't need it
+        if self._keycodes is not None:
+            return
+        try:
+            from piper import keycodes
+        except ImportError:
+            # Running from a source tree without the generated module
+            print("Warning: piper/keycodes.py was not generated, key names are unknown. "
+                  "Build Piper or run tools/gen-keycodes.py, see README.md.",
+                  file=sys.stderr)
+            self._keycodes, self._keynames, self._modifiers = {}, {}, ()
+            return
+        self._keycodes = keycodes.KEYCODES
+        self._keynames = keycodes.KEYNAMES
+        self._modifiers = keycodes.MODIFIERS
@@ -0,0 +1,359 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""The piper-cli command line tool. This module must not import Gtk, it
+only needs the ratbagd bindings and should start up quickly enough to be
+used from login scripts."""
+
+import argparse
+import sys
+
+from gi.repository import GLib
+from piper import devicestate
+from piper.actions import ActionCatalog
+from piper.macro import format_macro
+from piper.ratbagd import Ratbagd, RatbagdChangeSet, RatbagdDBusUnavailable, RatbagdLed
+
+
+LED_MODES = {
+    "off": RatbagdLed.LED_MODE_OFF,
+    "on": RatbagdLed.LED_MODE_ON,
+    "cycle": RatbagdLed.LED_MODE_CYCLE,
+    "breathing": RatbagdLed.LED_MODE_BREATHING,
+}
+
+
+ACTIONS = ActionCatalog()
+
+
+class CliError(Exception):
+    """An error to print to the user before exiting."""
+    pass
+
+
+def _find_device(ratbagd, name):
+    """Returns the device matching the given index, id or name."""
+    devices = ratbagd.devices
+    if name.isdigit() and int(name) < len(devices):
+        return devices[int(name)]
+    for device in devices:
+        if name in (device.id, device.name):
+            return device
+    raise CliError("No such device: {}".format(name))
+
+
+def _find_profile(device, index):
+    if index is None:
+        profile = device.active_profile
+        if profile is None:
+            raise CliError("Device {} has no active profile".format(device.name))
+        return profile
+    if not 0 <= index < len(device.profiles):
+        raise CliError("No such profile: {}".format(index))
+    return device.profiles[index]
+
+
+def _find_item(items, index, what):
+    if not 0 <= index < len(items):
+        raise CliError("No such {}: {}".format(what, index))
+    return items[index]
+
+
+def _commit(changes, actions=()):
+    """Writes the staged changes and runs the given async actions (e.g.
+    profile.set_active_async) in one batch, then waits for all of them to
+    complete. Raises CliError if any of them failed."""
+    loop = GLib.MainLoop()
+    errors = []
+    pending = [len(actions) + 1]
+
+    def done():
+        pending[0] -= 1
+        if pending[0] == 0:
+            loop.quit()
+
+    def on_committed(commit_errors):
+        errors.extend(commit_errors)
+        done()
+
+    def on_action_done(obj, result, error):
+        if error is not None:
+            errors.append((obj, error))
+        done()
+
+    for action in actions:
+        action(on_action_done)
+    changes.commit(on_committed)
+    if pending[0] > 0:
+        loop.run()
+
+    if errors:
+        raise CliError("\n".join("Failed to write to the device: {}".format(e.message)
+                                 for obj, e in errors))
+
+
+def _color(value):
+    """Parses an RRGGBB hex color for argparse into an (r, g, b) tuple."""
+    try:
+        if len(value) != 6:
+            raise ValueError(value)
+        color = int(value, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid color: {} (expected RRGGBB)".format(value))
+    return ((color >> 16) & 0xff, (color >> 8) & 0xff, color & 0xff)
+
+
+def _uint(value):
+    """Parses a non-negative integer for argparse, ratbagd takes them as
+    unsigned 32-bit values."""
+    try:
+        number = int(value)
+        if not 0 <= number <= 0xffffffff:
+            raise ValueError(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid value: {} (expected a non-negative number)".format(value))
+    return number
+
+
+def _same(obj, other):
+    # The bindings' __eq__ doesn't handle None
+    return other is not None and obj == other
+
+
+def _format_button(button):
+    action = button.action_type
+    if action == "button":
+        return "button {}".format(button.button_mapping)
+    elif action == "key":
+        return "key {}".format(" ".join(ACTIONS.key_name(k) for k in button.key))
+    elif action == "special":
+        return "special {}".format(button.special)
+    elif action == "macro":
+        return "macro {}".format(format_macro(button.macro, ACTIONS.key_name))
+    return action
+
+
+def _format_led(led):
+    modes = {v: k for k, v in LED_MODES.items()}
+    return "mode {}, color {:02x}{:02x}{:02x}, effect rate {} Hz, brightness {}".format(
+        modes.get(led.mode, led.mode), *led.color, led.effect_rate, led.brightness)
+
+
+def cmd_list(ratbagd, args):
+    for i, device in enumerate(ratbagd.devices):
+        print("{}: {} ({})".format(i, device.name, device.id))
+
+
+def cmd_info(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    active = device.active_profile
+    print("{} ({})".format(device.name, device.id))
+    for profile in device.profiles:
+        print("  Profile {}{}".format(profile.index,
+                                      " (active)" if _same(profile, active) else ""))
+        for resolution in profile.resolutions:
+            flags = []
+            if _same(resolution, profile.active_resolution):
+                flags.append("active")
+            if _same(resolution, profile.default_resolution):
+                flags.append("default")
+            print("    Resolution {}: {}x{} dpi, {} Hz{}".format(
+                resolution.index, *resolution.resolution, resolution.report_rate,
+                " ({})".format(", ".join(flags)) if flags else ""))
+        for button in profile.buttons:
+            print("    Button {}: {}".format(button.index, _format_button(button)))
+        for led in profile.leds:
+            print("    Led {}: {}".format(led.index, _format_led(led)))
+
+
+def cmd_profile(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    profile = _find_profile(device, args.profile)
+    _commit(RatbagdChangeSet(), [profile.set_active_async])
+
+
+def cmd_resolution(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    profile = _find_profile(device, args.profile)
+    resolution = _find_item(profile.resolutions, args.index, "resolution")
+    yres = args.yres if args.yres is not None else args.xres
+
+    changes = RatbagdChangeSet()
+    changes.set(resolution, "resolution", (args.xres, yres))
+    _commit(changes)
+
+
+def cmd_rate(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    profile = _find_profile(device, args.profile)
+
+    changes = RatbagdChangeSet()
+    for resolution in profile.resolutions:
+        changes.set(resolution, "report_rate", args.rate)
+    _commit(changes)
+
+
+def cmd_button(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    profile = _find_profile(device, args.profile)
+    button = _find_item(profile.buttons, args.index, "button")
+
+    changes = RatbagdChangeSet()
+    if args.action == "button":
+        if not args.value[0].isdigit():
+            raise CliError("Invalid button number: {}".format(args.value[0]))
+        changes.set(button, "button_mapping", int(args.value[0]))
+    elif args.action == "special":
+        if ACTIONS.special_label(args.value[0]) is None:
+            raise CliError("Unknown special action: {}".format(args.value[0]))
+        changes.set(button, "special", args.value[0])
+    elif args.action == "key":
+        keys = [ACTIONS.keycode(k) for k in args.value]
+        if None in keys:
+            message = "Unknown key: {}".format(args.value[keys.index(None)])
+            if not ACTIONS.has_keycodes:
+                message += " (only keycodes work, piper/keycodes.py was not generated)"
+            raise CliError(message)
+        changes.set(button, "key", keys)
+    _commit(changes)
+
+
+def cmd_led(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    profile = _find_profile(device, args.profile)
+    led = _find_item(profile.leds, args.index, "led")
+
+    changes = RatbagdChangeSet()
+    if args.mode is not None:
+        changes.set(led, "mode", LED_MODES[args.mode])
+    if args.color is not None:
+        changes.set(led, "color", args.color)
+    if args.effect_rate is not None:
+        changes.set(led, "effect_rate", args.effect_rate)
+    if args.brightness is not None:
+        changes.set(led, "brightness", args.brightness)
+    _commit(changes)
+
+
+def cmd_export(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    devicestate.dump(devicestate.export_device(device), args.file)
+
+
+def cmd_apply(ratbagd, args):
+    device = _find_device(ratbagd, args.device)
+    try:
+        doc = devicestate.load(args.file)
+        changes = RatbagdChangeSet()
+        actions = devicestate.apply_device(device, doc, changes)
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        raise CliError("Invalid device state: {}".format(e))
+    _commit(changes, actions)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="piper-cli",
+                                     description="Configure gaming mice through ratbagd")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("list", help="List the available devices")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("info", help="Show the state of a device")
+    p.add_argument("device", help="The device index, id or name")
+    p.set_defaults(func=cmd_info)
+
+    p = sub.add_parser("profile", help="Set the active profile")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("profile", type=_uint, help="The profile index")
+    p.set_defaults(func=cmd_profile)
+
+    p = sub.add_parser("resolution", help="Set a resolution in dpi")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("index", type=_uint, help="The resolution index")
+    p.add_argument("xres", type=_uint)
+    p.add_argument("yres", type=_uint, nargs="?")
+    p.set_defaults(func=cmd_resolution)
+
+    p = sub.add_parser("rate", help="Set the report rate in Hz")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("rate", type=_uint)
+    p.set_defaults(func=cmd_rate)
+
+    p = sub.add_parser("button", help="Set a button mapping")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("index", type=_uint, help="The button index")
+    p.add_argument("action", choices=["button", "special", "key"])
+    p.add_argument("value", nargs="+",
+                   help="The button number, the special action or the key followed by modifier keys, "
+                        "as keycodes or names like KEY_A")
+    p.set_defaults(func=cmd_button)
+
+    p = sub.add_parser("led", help="Configure a led")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("index", type=_uint, help="The led index")
+    p.add_argument("--mode", choices=sorted(LED_MODES))
+    p.add_argument("--color", type=_color, help="The color as RRGGBB hex value")
+    p.add_argument("--effect-rate", type=_uint)
+    p.add_argument("--brightness", type=_uint)
+    p.set_defaults(func=cmd_led)
+
+    p = sub.add_parser("export", help="Write the state of a device as JSON")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("file", type=argparse.FileType("w"), nargs="?", default=sys.stdout,
+                   help="The file to write to, defaults to stdout")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("apply",
+                       help="Apply a state written by export, only writing what differs")
+    p.add_argument("device", help="The device index, id or name")
+    p.add_argument("file", type=argparse.FileType("r"), nargs="?", default=sys.stdin,
+                   help="The file to read from, defaults to stdin")
+    p.set_defaults(func=cmd_apply)
+
+    # The commands changing a profile's settings apply to the active
+    # profile unless another one is given
+    for name, p in sub.choices.items():
+        if name not in ("list", "info", "profile", "export", "apply"):
+            p.add_argument("--profile", "-p", type=_uint,
+                           help="The profile index, defaults to the active profile")
+
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+
+    # Devices and profiles are only created on first access, the daemon
+    # may be gone by then
+    try:
+        ratbagd = Ratbagd()
+        args.func(ratbagd, args)
+    except RatbagdDBusUnavailable:
+        print("Can't connect to ratbagd on DBus.", file=sys.stderr)
+        return 1
+    except CliError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
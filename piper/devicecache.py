@@ -0,0 +1,70 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Keeps snapshots of the devices of the last run in
+$XDG_CACHE_HOME/piper/devices.json, so the next start can show them
+before ratbagd answered. See RatbagdDevice.snapshot()."""
+
+import json
+import os
+
+from gi.repository import GLib
+from piper.ratbagd import RatbagdDevice
+
+
+def cache_path():
+    return os.path.join(GLib.get_user_cache_dir(), "piper", "devices.json")
+
+
+def load():
+    """Returns the devices of the last run restored from their snapshots,
+    in the same order. Returns an empty list if there are none or the
+    cache can't be read."""
+    try:
+        with open(cache_path()) as f:
+            snapshots = json.load(f)
+        return [RatbagdDevice.from_snapshot(s) for s in snapshots]
+    except (OSError, ValueError, TypeError, AttributeError):
+        return []
+
+
+def matches(device, other):
+    """Returns True if both devices have the same id and name, i.e. a
+    snapshot device can be attached to the live one."""
+    return (device.id, device.name) == (other.id, other.name)
+
+
+def save(devices):
+    """Stores snapshots of the given live devices, replacing the previous
+    ones. Failing to write the cache is not an error."""
+    path = cache_path()
+    try:
+        snapshots = [d.snapshot() for d in devices]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(snapshots, f, separators=(",", ":"))
+        os.rename(tmp, path)
+    except OSError:
+        pass
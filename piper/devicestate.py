@@ -0,0 +1,192 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Export and apply the full state of a ratbagd device as a JSON document.
+A document looks like this:
+
+{
+  "version": 1,
+  "name": "Logitech G500",
+  "id": "hidraw0",
+  "profiles": [
+    {
+      "index": 0,
+      "active": true,
+      "resolutions": [
+        {"index": 0, "xres": 800, "yres": 800, "report_rate": 1000,
+         "active": true, "default": true}
+      ],
+      "buttons": [
+        {"index": 0, "action_type": "button", "button_mapping": 1},
+        {"index": 1, "action_type": "special", "special": "wheel-up"},
+        {"index": 2, "action_type": "key", "key": [30, 29]},
+        {"index": 3, "action_type": "macro", "macro": [[1, 30], [3, 50], [2, 30]]}
+      ],
+      "leds": [
+        {"index": 0, "mode": 1, "color": [255, 0, 0], "effect_rate": 1000,
+         "brightness": 255}
+      ]
+    }
+  ]
+}
+
+Applying a document only writes the values that differ from the device.
+"""
+
+import json
+
+from piper.snapshot import DeviceState
+
+VERSION = 1
+
+
+def export_device(device):
+    """Returns the state of the given RatbagdDevice as a dict in the format
+    described above."""
+    return export_state(DeviceState.from_device(device))
+
+
+def export_state(state):
+    """Returns the given piper.snapshot.DeviceState as a dict in the format
+    described above."""
+    return {
+        "version": VERSION,
+        "name": state.name,
+        "id": state.id,
+        "profiles": [_export_profile(p, state.active_profile) for p in state.profiles],
+    }
+
+
+def _export_profile(profile, active_profile):
+    return {
+        "index": profile.index,
+        "active": profile.index == active_profile,
+        "resolutions": [{
+            "index": r.index,
+            "xres": r.xres,
+            "yres": r.yres,
+            "report_rate": r.report_rate,
+            "active": r.index == profile.active_resolution,
+            "default": r.index == profile.default_resolution,
+        } for r in profile.resolutions],
+        "buttons": [_export_button(b) for b in profile.buttons],
+        "leds": [{
+            "index": led.index,
+            "mode": led.mode,
+            "color": list(led.color),
+            "effect_rate": led.effect_rate,
+            "brightness": led.brightness,
+        } for led in profile.leds],
+    }
+
+
+def _export_button(button):
+    b = {
+        "index": button.index,
+        "action_type": button.action_type,
+    }
+    if button.action_type == "button":
+        b["button_mapping"] = button.button_mapping
+    elif button.action_type == "special":
+        b["special"] = button.special
+    elif button.action_type == "key":
+        b["key"] = list(button.key)
+    elif button.action_type == "macro":
+        b["macro"] = [list(event) for event in button.macro]
+    return b
+
+
+def apply_device(device, doc, changes):
+    """Stages the differences between the given document and the device
+    in the RatbagdChangeSet. Values identical on the device are not staged,
+    so applying an unchanged document causes no writes at all.
+
+    Setting the active profile and the default resolution are not
+    properties, those are returned as a list of functions taking a
+    completion callback (e.g. profile.set_active_async) that need to be
+    called in addition to committing the changes.
+
+    Raises ValueError if the document doesn't match the device.
+
+    @param device The RatbagdDevice
+    @param doc The document, as dict
+    @param changes The RatbagdChangeSet to stage the changes in
+    """
+    if doc.get("version") != VERSION:
+        raise ValueError("Unsupported document version {}".format(doc.get("version")))
+
+    actions = []
+    active_profile = device.active_profile
+    for p in doc["profiles"]:
+        profile = _lookup(device.profiles, p, "profile")
+
+        if p.get("active") and (active_profile is None or profile != active_profile):
+            actions.append(profile.set_active_async)
+
+        default = profile.default_resolution
+        for r in p.get("resolutions", []):
+            resolution = _lookup(profile.resolutions, r, "resolution")
+            changes.set(resolution, "resolution", (r["xres"], r["yres"]))
+            changes.set(resolution, "report_rate", r["report_rate"])
+            if r.get("default") and (default is None or resolution != default):
+                actions.append(resolution.set_default_async)
+
+        for b in p.get("buttons", []):
+            button = _lookup(profile.buttons, b, "button")
+            action_type = b["action_type"]
+            if action_type == "button":
+                changes.set(button, "button_mapping", b["button_mapping"])
+            elif action_type == "special":
+                changes.set(button, "special", b["special"])
+            elif action_type == "key":
+                changes.set(button, "key", list(b["key"]))
+            elif action_type == "macro":
+                changes.set(button, "macro", [tuple(event) for event in b["macro"]])
+            # other action types can't be written through ratbagd
+
+        for d in p.get("leds", []):
+            led = _lookup(profile.leds, d, "led")
+            changes.set(led, "mode", d["mode"])
+            changes.set(led, "color", tuple(d["color"]))
+            changes.set(led, "effect_rate", d["effect_rate"])
+            changes.set(led, "brightness", d["brightness"])
+
+    return actions
+
+
+def _lookup(items, d, what):
+    index = d["index"]
+    if not 0 <= index < len(items):
+        raise ValueError("The device has no {} {}".format(what, index))
+    return items[index]
+
+
+def dump(doc, fp):
+    """Writes the document as JSON to the given file object."""
+    json.dump(doc, fp, indent=2, sort_keys=True)
+    fp.write("\n")
+
+
+def load(fp):
+    """Reads a document from the given file object."""
+    return json.load(fp)
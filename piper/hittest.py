@@ -0,0 +1,131 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Maps points on a device image to the buttons drawn there. The device
+SVGs from libratbag name the elements of button N "buttonN", and the
+line pointing at it "buttonN-leader". Their bounding boxes are extracted
+once per SVG and put into a HitIndex, so resolving a pointer position
+doesn't need to look at the SVG again.
+
+The bounding boxes come from librsvg, without it there is no hit-testing.
+"""
+
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+import gi
+from gi.repository import GLib
+try:
+    gi.require_version('Rsvg', '2.0')
+    from gi.repository import Rsvg
+except (ImportError, ValueError):
+    Rsvg = None
+
+_BUTTON_ID = re.compile(r"^button(\d+)(-leader)?$")
+
+
+class HitIndex(object):
+    """A uniform grid over a set of (key, x, y, width, height) boxes. Each
+    grid cell lists the boxes overlapping it, so a lookup only checks the
+    few boxes in one cell instead of all of them."""
+
+    def __init__(self, boxes, width, height, cell_size=32):
+        """
+        @param boxes A list of (key, x, y, width, height) tuples
+        @param width The width of the area covered by the boxes
+        @param height The height of the area covered by the boxes
+        """
+        self.width = width
+        self.height = height
+        self._boxes = list(boxes)
+        self._cell_size = cell_size
+        self._cells = {}
+        self._by_key = {}
+        for i, (key, x, y, w, h) in enumerate(self._boxes):
+            self._by_key.setdefault(key, []).append((x, y, w, h))
+            for cx in range(int(x // cell_size), int((x + w) // cell_size) + 1):
+                for cy in range(int(y // cell_size), int((y + h) // cell_size) + 1):
+                    self._cells.setdefault((cx, cy), []).append(i)
+
+    def lookup(self, x, y):
+        """Returns the key of the box containing the given point, the
+        smallest one if several do, or None."""
+        cell = (int(x // self._cell_size), int(y // self._cell_size))
+        best, best_area = None, None
+        for i in self._cells.get(cell, ()):
+            key, bx, by, bw, bh = self._boxes[i]
+            if bx <= x <= bx + bw and by <= y <= by + bh:
+                if best_area is None or bw * bh < best_area:
+                    best, best_area = key, bw * bh
+        return best
+
+    def boxes(self, key):
+        """Returns the list of (x, y, width, height) boxes of the key."""
+        return self._by_key.get(key, [])
+
+    def __len__(self):
+        return len(self._boxes)
+
+
+def parse_svg(path):
+    """Returns the HitIndex of the button elements in the given SVG, in
+    SVG user units, keyed by button index. Returns None if the SVG can't
+    be loaded or librsvg isn't available."""
+    if Rsvg is None:
+        return None
+
+    try:
+        handle = Rsvg.Handle.new_from_file(path)
+        ids = [e.get("id") for e in ET.parse(path).iter() if e.get("id")]
+    except (GLib.Error, ET.ParseError, OSError):
+        return None
+
+    boxes = []
+    for element_id in ids:
+        m = _BUTTON_ID.match(element_id)
+        if m is None:
+            continue
+        sub = "#{}".format(element_id)
+        ok, pos = handle.get_position_sub(sub)
+        ok2, dim = handle.get_dimensions_sub(sub)
+        if ok and ok2:
+            boxes.append((int(m.group(1)), pos.x, pos.y, dim.width, dim.height))
+
+    dim = handle.get_dimensions()
+    return HitIndex(boxes, dim.width, dim.height)
+
+
+def parse_svg_async(path, callback, *user_data):
+    """Runs parse_svg() in a worker thread, callback(index, *user_data) is
+    invoked from the main loop once it is done."""
+    def parse():
+        GLib.idle_add(_deliver, callback, parse_svg(path), user_data)
+
+    threading.Thread(target=parse, daemon=True).start()
+
+
+def _deliver(callback, index, user_data):
+    callback(index, *user_data)
+    return False
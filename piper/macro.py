@@ -0,0 +1,227 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Button macros: key presses, key releases and the delays between them.
+A Macro keeps its events in a flat array of (type, value) pairs, the
+encoding of the Button's Macro property on D-Bus, and never grows beyond
+the number of events a device can store. A MacroRecorder turns key events
+as they come in into a Macro.
+
+    macro = Macro()
+    recorder = MacroRecorder(macro)
+    recorder.key_event(True, 30)    # KEY_A down
+    recorder.key_event(False, 30)   # KEY_A up, some ms later
+    button.set_macro_async(macro.to_list())
+"""
+
+import array
+import time
+
+from piper.ratbagd import RatbagdButton
+
+
+KEY_PRESSED = RatbagdButton.MACRO_KEY_PRESSED
+KEY_RELEASED = RatbagdButton.MACRO_KEY_RELEASED
+WAIT = RatbagdButton.MACRO_WAIT
+
+
+class Macro(object):
+    """A sequence of (type, value) events: KEY_PRESSED and KEY_RELEASED
+    with the keycode as value, WAIT with a delay in ms.
+
+    Delays are only kept between two key events, consecutive ones are
+    merged into one. Every key pressed keeps a slot free for its release,
+    so a full macro never leaves a key held down.
+    """
+
+    # The most events devices can store
+    MAX_EVENTS = 256
+
+    # The longest single delay in ms, longer ones are cut short
+    MAX_DELAY = 65535
+
+    def __init__(self, events=(), max_events=MAX_EVENTS):
+        """
+        @param events The (type, value) events to start with, e.g. the
+                      button's macro. Events that don't fit are dropped.
+        @param max_events The most events this macro holds
+        """
+        self.max_events = max_events
+        self._data = array.array("I")
+        # The keys pressed and not released yet, in the order pressed
+        self._held = []
+
+        delay = 0
+        for type, value in events:
+            if type == WAIT:
+                delay += value
+            elif type in (KEY_PRESSED, KEY_RELEASED):
+                self.add_key(type, value, delay)
+                delay = 0
+
+    def __len__(self):
+        return len(self._data) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Macro index out of range")
+        return (self._data[2 * index], self._data[2 * index + 1])
+
+    def __iter__(self):
+        data = self._data
+        for i in range(0, len(data), 2):
+            yield (data[i], data[i + 1])
+
+    def __eq__(self, other):
+        return isinstance(other, Macro) and self._data == other._data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Macro of {} events>".format(len(self))
+
+    @property
+    def full(self):
+        """True if no further key can be pressed."""
+        return not self._room(2)
+
+    def _room(self, needed):
+        return len(self) + needed + len(self._held) <= self.max_events
+
+    def add_key(self, type, keycode, delay=0):
+        """Appends a key press or release, after a delay of the given ms.
+        Returns the index of the first event that changed, or None if the
+        key was dropped: a press of a key already held (i.e. a key repeat)
+        or one that doesn't fit anymore, or a release of a key not held.
+
+        @param type KEY_PRESSED or KEY_RELEASED
+        @param keycode The keycode, as int
+        @param delay The delay before the key in ms, as int
+        """
+        if type == KEY_PRESSED:
+            if keycode in self._held:
+                return None
+            # The press and its release
+            needed = 2
+        else:
+            if keycode not in self._held:
+                return None
+            # Its slot is kept free already
+            needed = 0
+        if not self._room(needed):
+            return None
+
+        first = None
+        delay = min(int(delay), self.MAX_DELAY)
+        # Every delay is followed by its key, there's never one to merge with
+        if delay > 0 and len(self) > 0 and self._room(needed + 1):
+            self._data.extend((WAIT, delay))
+            first = len(self) - 1
+
+        if type == KEY_PRESSED:
+            self._held.append(keycode)
+        else:
+            self._held.remove(keycode)
+        self._data.extend((type, keycode))
+        return first if first is not None else len(self) - 1
+
+    def finish(self):
+        """Releases the keys still held down, in reverse order of their
+        presses, so the macro doesn't leave them pressed on the device.
+        Their slots are kept free, this always fits. Returns the index of
+        the first event added, or None if no key was held."""
+        first = None
+        for keycode in reversed(list(self._held)):
+            index = self.add_key(KEY_RELEASED, keycode)
+            if first is None:
+                first = index
+        return first
+
+    def to_list(self):
+        """Returns the events as list of (type, value) tuples, as taken by
+        RatbagdButton.set_macro_async()."""
+        return list(self)
+
+
+class MacroRecorder(object):
+    """Records key events into a Macro, with the time between two events
+    as their delay. Delays shorter than MIN_DELAY ms, e.g. between the keys
+    of a chord, are dropped.
+    """
+
+    MIN_DELAY = 10
+
+    def __init__(self, macro):
+        self.macro = macro
+        self._last = None
+
+    def key_event(self, pressed, keycode, timestamp=None):
+        """Records a key press or release. Returns the index of the first
+        event of the macro that changed, or None if the event was dropped,
+        see Macro.add_key().
+
+        @param pressed True for a key press, False for a release
+        @param keycode The keycode, as int
+        @param timestamp The time.monotonic() time of the event, now if None
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        delay = 0
+        if self._last is not None:
+            delay = int(round((timestamp - self._last) * 1000))
+            if delay < self.MIN_DELAY:
+                delay = 0
+
+        index = self.macro.add_key(KEY_PRESSED if pressed else KEY_RELEASED,
+                                   keycode, delay)
+        if index is not None:
+            self._last = timestamp
+        return index
+
+
+def format_event(event, key_name):
+    """Returns a short text for a (type, value) event, "+KEY_A" for a
+    press, "-KEY_A" for a release and "50ms" for a delay.
+
+    @param key_name A function returning the name of a keycode, e.g.
+                    ActionCatalog.key_name
+    """
+    type, value = event
+    if type == KEY_PRESSED:
+        return "+{}".format(key_name(value))
+    elif type == KEY_RELEASED:
+        return "-{}".format(key_name(value))
+    elif type == WAIT:
+        return "{}ms".format(value)
+    return "?"
+
+
+def format_macro(events, key_name):
+    """Returns a short text for a list of (type, value) events, see
+    format_event()."""
+    return " ".join(format_event(e, key_name) for e in events)
@@ -2,15 +2,28 @@
 # vim: set expandtab shiftwidth=4 tabstop=4
 
 from piper.ratbagd import *
+from piper.actions import ActionCatalog
+from piper.macro import Macro, MacroRecorder, format_event, format_macro
+from piper.signals import SignalBindings
+from piper import devicecache, hittest, startup, svgcache
+import cairo
+import colorsys
+import math
 import os
 
 import gi
 gi.require_version('Gio', '2.0')
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gio
+from gi.repository import Gtk, Gdk, Gio, GLib, GObject
 
 class Piper(Gtk.Window):
 
+    # Emitted once the startup is complete, i.e. every device is loaded
+    # (or failed to) and the result was drawn
+    __gsignals__ = {
+        "ready": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
     def _show_error(self, message):
         box = self._builder.get_object("piper-error-box")
 
@@ -22,175 +35,784 @@ class Piper(Gtk.Window):
 
         self.add(box)
         self.show()
+        self._startup_done()
 
-    def _show_btnmap_dialog(self, button):
-        dialog = self._builder.get_object("piper-btnmap-dialog")
-        dialog.set_transient_for(self)
-
-        sb = self._builder.get_object("piper-btnmap-btnmap-spinbutton")
-        sb.connect("value-changed", self.on_btnmap_changed, button)
-
-        c = self._builder.get_object("piper-btnmap-custommap-combo")
-        # select the currently selected function
-        tree = c.get_model()
-        it = tree.get_iter_first()
-        while it:
-            v = button.special
-            if tree.get_value(it, 1) == v:
-                c.set_active_iter(it)
-                break;
-            it = tree.iter_next(it)
-        if it == None:
-            c.set_active_iter(tree.get_iter_first())
-
-        c.connect("changed", self.on_custommap_changed, button)
-
-        radio = self._builder.get_object("piper-btnmap-btnmap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_button, button)
-        radio.set_active(button.action_type == "button")
-
-        radio = self._builder.get_object("piper-btnmap-keymap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_key, button)
-        radio.set_active(button.action_type == "key")
-
-        radio = self._builder.get_object("piper-btnmap-keyseqmap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_macro, button)
-        radio.set_active(button.action_type == "macro")
-
-        radio = self._builder.get_object("piper-btnmap-custommap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_special, button)
-        radio.set_active(button.action_type == "special")
-
-        response = dialog.run()
+    def _startup_done(self):
+        # Redraws have a higher priority than idle callbacks, so this runs
+        # after the window is drawn
+        GLib.idle_add(self._on_startup_idle)
 
-        self._update_from_device()
-
-        dialog.hide()
+    def _on_startup_idle(self):
+        startup.mark("ready")
+        self.emit("ready")
+        return False
 
     def __init__(self):
         Gtk.Window.__init__(self, title="Piper")
         main_window = Gtk.Builder()
         main_window.add_from_resource("/org/freedesktop/Piper/piper.ui")
+        startup.mark("piper.ui")
         self._builder = main_window;
-        self._signal_ids = []
-        self._initialized = False
-        self._button_function_labels = []
+        self._actions = ActionCatalog.from_model(main_window.get_object("piper-btnmap-custommap-liststore"))
+        self._ratbag = None
+        self._device_pages = []
+        self._devices = []
+        self._current_device = 0
+        self._dirty_bindings = []
+        self._stack = None
 
-        self._ratbag_device = self._fetch_ratbag_device()
-        if self._ratbag_device == None:
-            return
+        self.connect("delete-event", Gtk.main_quit)
 
-        self._profile_buttons = []
-        self._current_profile = self._ratbag_device.active_profile
+        # Show the devices of the last run right away, they are updated or
+        # replaced once the live devices are loaded
+        self._snapshot_devices = devicecache.load()
+        if len(self._snapshot_devices) > 0:
+            self._init_pages(len(self._snapshot_devices))
+            for i, device in enumerate(self._snapshot_devices):
+                self._set_device_page(i, device)
+            startup.mark("snapshot")
+
+        # Only the manager is loaded here, each device is loaded separately
+        # in the background so that a slow device doesn't block the others
+        Ratbagd.new_async(self._on_ratbagd_loaded, recursive=False)
+
+    def _init_pages(self, ndevices):
+        self._device_pages = [None] * ndevices
+        self._devices = [None] * ndevices
+
+        self._stack = Gtk.Stack()
+        self._profile_stack = Gtk.Stack()
+        self._init_header(ndevices)
+
+        for i in range(ndevices):
+            spinner = Gtk.Spinner()
+            spinner.start()
+            self._stack.add_named(spinner, "device{}".format(i))
+            self._profile_stack.add_named(Gtk.Box(), "device{}".format(i))
+
+        self.add(self._stack)
+        self._stack.show_all()
+        self._profile_stack.show_all()
+        self.show()
 
-        grid = main_window.get_object("piper-grid")
-        self._init_header(self._ratbag_device)
-        self.add(grid)
+    def _remove_pages(self):
+        for page in self._device_pages:
+            if page != None:
+                page.destroy()
+        self.remove(self._stack)
+        self.set_titlebar(None)
+        self._stack = None
+        self._device_pages = []
+        self._devices = []
+
+    def _on_ratbagd_loaded(self, ratbag):
+        startup.mark("ratbagd")
+        if ratbag == None or len(ratbag.devices) == 0:
+            if self._stack != None:
+                self._remove_pages()
+        if ratbag == None:
+            self._show_error("Can't connect to ratbagd on DBus. That's quite unfortunate.")
+            return
+        if len(ratbag.devices) == 0:
+            self._show_error("Could not find any devices. Do you have anything vaguely mouse-looking plugged in?")
+            return
 
-        # load the right image
-        svg = self._ratbag_device.svg_path
-        img = main_window.get_object("piper-image-device")
-        if not os.path.isfile(svg):
-            img.set_from_resource("/org/freedesktop/Piper/404.svg")
+        self._ratbag = ratbag
+        self._devices_pending = len(ratbag.devices)
+
+        # The devices of the last run are only reused if there are as many,
+        # each one is checked against the live device once that is loaded
+        if len(ratbag.devices) != len(self._snapshot_devices):
+            if self._stack != None:
+                self._remove_pages()
+            self._snapshot_devices = []
+            self._init_pages(len(ratbag.devices))
+
+        for i in range(len(ratbag.devices)):
+            ratbag.devices.load_async(i, self._on_device_loaded, i)
+
+    def _on_device_loaded(self, device, idx):
+        startup.mark("device{} loaded".format(idx))
+
+        snapshot = self._devices[idx]
+        if (device != None and snapshot != None and snapshot.is_snapshot and
+                devicecache.matches(snapshot, device) and snapshot.attach(device)):
+            # The page stays, only the values that differ from the
+            # snapshot are updated
+            if self._device_pages[idx] != None:
+                self._device_pages[idx].attached()
         else:
-            img.set_from_file(svg)
-
-        # init the current profile's data
-        p = self._current_profile
-        self._init_report_rate(main_window, p)
-        self._init_resolution(main_window, p)
-        self._init_buttons(main_window, p)
-
-        self._update_from_device()
-        self._connect_signals()
-        self._initialized = True
+            # The staged changes refer to the snapshot's objects, which
+            # don't match the live device, so they can't be carried over
+            old = self._device_pages[idx]
+            lost = old != None and old.unsaved
+            self._set_device_page(idx, device)
+            if lost:
+                self._show_changes_lost(snapshot.name)
+
+        self._devices_pending -= 1
+        if self._devices_pending == 0:
+            self._startup_done()
+            GLib.idle_add(self._save_snapshots)
+
+    def _show_changes_lost(self, name):
+        dialog = Gtk.MessageDialog(transient_for=self,
+                                   modal=True,
+                                   message_type=Gtk.MessageType.WARNING,
+                                   buttons=Gtk.ButtonsType.OK,
+                                   text="Your changes to {} were not saved".format(name))
+        dialog.format_secondary_text("The device differs from when Piper last ran, "
+                                     "its settings were reloaded. Please make your changes again.")
+        dialog.connect("response", lambda dialog, response: dialog.destroy())
+        dialog.show()
+
+    def _save_snapshots(self):
+        devicecache.save([d for d in self._devices if d != None])
+        return False
+
+    def _set_device_page(self, idx, device):
+        name = "device{}".format(idx)
+        self._stack.remove(self._stack.get_child_by_name(name))
+        self._profile_stack.remove(self._profile_stack.get_child_by_name(name))
+        if self._device_pages[idx] != None:
+            self._device_pages[idx].destroy()
+        self._devices[idx] = device
+        self._device_pages[idx] = None
+
+        if device == None:
+            page = Gtk.Label("Failed to load this device.")
+            self._profile_stack.add_named(Gtk.Box(), name)
+        elif len(device.profiles) == 1 and len(device.profiles[0].resolutions) == 1:
+            page = Gtk.Label("Device {} does not support switchable resolutions".format(device.name))
+            self._profile_stack.add_named(Gtk.Box(), name)
+        else:
+            self._device_pages[idx] = DevicePage(self, self._builder, device, self._actions)
+            page = self._device_pages[idx].widget
+            self._profile_stack.add_named(self._device_pages[idx].profile_box, name)
+
+        self._stack.add_named(page, name)
+        page.show_all()
+        self._profile_stack.show_all()
+
+        if device != None:
+            self._device_combo.get_model()[idx][0] = device.name
+
+        if idx == self._current_device:
+            self._show_device(idx)
+
+    def _show_device(self, idx):
+        self._current_device = idx
+        name = "device{}".format(idx)
+        self._stack.set_visible_child_name(name)
+        self._profile_stack.set_visible_child_name(name)
+
+        for binding in self._dirty_bindings:
+            binding.unbind()
+        self._dirty_bindings = []
+
+        page = self._device_pages[idx]
+        if page == None:
+            for button in self._save_reset_buttons:
+                button.set_sensitive(False)
+            return
 
-        self.connect("delete-event", Gtk.main_quit)
-        self.show()
+        self._header.props.title = "{}".format(page.device.name)
+        for button in self._save_reset_buttons:
+            binding = page.changes.bind_property("dirty", button, "sensitive",
+                                                 GObject.BindingFlags.SYNC_CREATE)
+            self._dirty_bindings.append(binding)
 
-    def  _init_header(self, device):
+    def  _init_header(self, ndevices):
         hb = Gtk.HeaderBar()
         hb.set_show_close_button(True)
-        hb.props.title = "{}".format(device.name)
+        hb.props.title = "Piper"
         self.set_titlebar(hb)
+        self._header = hb
 
         # apply/reset buttons
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         Gtk.StyleContext.add_class(box.get_style_context(), "linked")
+        self._save_reset_buttons = []
 
         button = Gtk.Button()
         icon = Gio.ThemedIcon(name="edit-undo-symbolic")
         image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
         button.add(image)
         button.connect("clicked", self.on_button_reset_clicked)
+        button.set_sensitive(False)
         box.add(button)
+        self._save_reset_buttons.append(button)
 
         button = Gtk.Button()
         icon = Gio.ThemedIcon(name="document-save-symbolic")
         image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
         button.add(image)
         button.connect("clicked", self.on_button_save_clicked)
+        button.set_sensitive(False)
         box.add(button)
+        self._save_reset_buttons.append(button)
 
         hb.pack_end(box)
 
-        # Profile buttons
+        # Device picker, the names are filled in as the devices load
+        self._device_combo = Gtk.ComboBoxText()
+        for i in range(ndevices):
+            self._device_combo.append_text("Loading device {}...".format(i))
+        self._device_combo.set_active(self._current_device)
+        self._device_combo.connect("changed", self.on_device_changed)
+        hb.pack_start(self._device_combo)
+
+        # Each device's profile buttons
+        hb.pack_start(self._profile_stack)
+
+        hb.show_all()
+        self._device_combo.set_visible(ndevices > 1)
+
+    def on_device_changed(self, widget):
+        self._show_device(widget.get_active())
+
+    def on_button_save_clicked(self, widget):
+        self._device_pages[self._current_device].save()
+
+    def on_button_reset_clicked(self, widget):
+        self._device_pages[self._current_device].reset()
+
+
+class DevicePage(object):
+    """The configuration widgets of a single device, along with that
+    device's state. Each device gets its own set of widgets so switching
+    between devices doesn't need to refresh anything."""
+
+    # piper-image-device's width request minus its padding
+    IMAGE_WIDTH = 300
+
+    def _show_btnmap_dialog(self, button):
+        dialog = self._dialog_builder.get_object("piper-btnmap-dialog")
+        dialog.set_transient_for(self._window)
+
+        # The dialog is shared by all devices and buttons, its handlers are
+        # only connected while it is shown for this button so each change
+        # is staged exactly once
+        bindings = SignalBindings()
+
+        sb = self._dialog_builder.get_object("piper-btnmap-btnmap-spinbutton")
+        bindings.connect(sb, "value-changed", self.on_btnmap_changed, button)
+
+        c = self._dialog_builder.get_object("piper-btnmap-custommap-combo")
+        bindings.connect(c, "changed", self.on_custommap_changed, button)
+
+        radios = [("piper-btnmap-btnmap-radio", "button", self.on_actiontype_changed_button),
+                  ("piper-btnmap-keymap-radio", "key", self.on_actiontype_changed_key),
+                  ("piper-btnmap-keyseqmap-radio", "macro", self.on_actiontype_changed_macro),
+                  ("piper-btnmap-custommap-radio", "special", self.on_actiontype_changed_special)]
+        for name, action_type, handler in radios:
+            radio = self._dialog_builder.get_object(name)
+            bindings.connect(radio, "toggled", handler, button)
+
+        # show the button's current mapping without staging anything
+        action_type = self._changes.get(button, "action_type")
+        widgets = [sb, c] + [self._dialog_builder.get_object(r[0]) for r in radios]
+        with bindings.blocked(*widgets):
+            sb.set_value(self._changes.get(button, "button_mapping"))
+            # select the currently selected function
+            row = self._actions.special_row(self._changes.get(button, "special"))
+            c.set_active(row if row != None else 0)
+            for name, t, handler in radios:
+                self._dialog_builder.get_object(name).set_active(action_type == t)
+
+        # ratbagd itself has no macros, see RatbagdButton.macro_supported
+        for name in ("piper-btnmap-keyseqmap-radio", "piper-btnmap-keyseqmap-record-button",
+                     "piper-btnmap-keyseqmap-clear-button"):
+            self._dialog_builder.get_object(name).set_sensitive(button.macro_supported)
+
+        self._key_editor = KeyEditor(self._dialog_builder, bindings, self._actions,
+                                     self._changes.get(button, "key"),
+                                     lambda keys: self.on_key_captured(keys, button))
+        self._macro_editor = MacroEditor(self._dialog_builder, bindings, self._actions,
+                                         Macro(self._changes.get(button, "macro")),
+                                         lambda macro: self.on_macro_recorded(macro, button))
+
+        response = dialog.run()
+        self._key_editor.stop()
+        self._macro_editor.stop()
+        dialog.hide()
+        bindings.disconnect_all()
+
+    def __init__(self, window, dialog_builder, device, actions):
+        builder = Gtk.Builder()
+        objects = ["piper-grid", "piper-nresolutions-adjustment"]
+        builder.add_objects_from_resource("/org/freedesktop/Piper/piper.ui", objects)
+        self._builder = builder
+        self._dialog_builder = dialog_builder
+        self._window = window
+        self._actions = actions
+        self._save_pending = False
+        self._bindings = SignalBindings()
+        self._changes = RatbagdChangeSet()
+
+        self._ratbag_device = device
+        self._profile_buttons = []
+        self._current_profile = device.active_profile
+
+        self.widget = builder.get_object("piper-grid")
+        self.profile_box = self._init_profile_buttons(device)
+
+        # load the right image, rendered (or loaded from the cache) in the
+        # background at the size it is shown at
+        svg = device.svg_path
+        img = builder.get_object("piper-image-device")
+        self.widget.remove(img)
+        self._image = PiperImage(img, self.IMAGE_WIDTH)
+        self._image.connect("button-clicked", self.on_image_button_clicked)
+        self.widget.attach(self._image, 0, 0, 1, 1)
+        if not os.path.isfile(svg):
+            img.set_from_resource("/org/freedesktop/Piper/404.svg")
+        else:
+            img.clear()
+            scale = window.get_scale_factor()
+            svgcache.load_async(svg, self.IMAGE_WIDTH * scale, -1,
+                                self._on_svg_loaded, img, scale)
+            hittest.parse_svg_async(svg, self._on_svg_parsed)
+
+        # Each profile has its own page in the stack, switching profiles
+        # only changes the visible page. The current profile's page is
+        # built right away from the grid's own box, the others are built
+        # in the background one by one.
+        box = builder.get_object("piper-box")
+        self.widget.remove(box)
+        self._stack = Gtk.Stack()
+        self._stack.set_transition_type(Gtk.StackTransitionType.NONE)
+        self.widget.attach(self._stack, 1, 0, 1, 1)
+
+        self._profile_pages = [None] * len(device.profiles)
+        self._add_profile_page(self._current_profile.index, builder)
+        self._stack.set_visible_child_name("profile{}".format(self._current_profile.index))
+        startup.mark("{} page".format(device.name))
+
+        self._connect_signals()
+        self._build_source = GLib.idle_add(self._on_build_profile_pages)
+
+    def destroy(self):
+        """Disconnects the page from the device, called when the page is
+        replaced. The ratbagd objects outlive it."""
+        if self._build_source != None:
+            GLib.source_remove(self._build_source)
+            self._build_source = None
+        for page in self._profile_pages:
+            if page != None:
+                page.destroy()
+        self._bindings.disconnect_all()
+
+    def _on_svg_loaded(self, pixbuf, img, scale):
+        startup.mark("{} svg".format(self._ratbag_device.name))
+        if pixbuf == None:
+            img.set_from_resource("/org/freedesktop/Piper/404.svg")
+            return
+        surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, scale, None)
+        img.set_from_surface(surface)
+
+    def _on_svg_parsed(self, index):
+        self._image.set_hit_index(index)
+
+    def on_image_button_clicked(self, widget, idx):
+        buttons = self._current_profile.buttons
+        if idx < len(buttons):
+            self._show_btnmap_dialog(buttons[idx])
+
+    @property
+    def device(self):
+        """The RatbagdDevice shown on this page."""
+        return self._ratbag_device
+
+    @property
+    def changes(self):
+        """The RatbagdChangeSet with this device's unsaved changes."""
+        return self._changes
+
+    @property
+    def unsaved(self):
+        """True if there are staged changes or a save waiting for the live
+        device."""
+        return self._save_pending or self._changes.dirty
+
+    def save(self):
+        if self._ratbag_device.is_snapshot:
+            # written once the live device is attached
+            self._save_pending = True
+            return
+        self._changes.commit(self._on_changes_committed)
+
+    def attached(self):
+        """Called once the live device is attached to the snapshot device
+        shown on this page."""
+        if self._save_pending:
+            self._save_pending = False
+            self.save()
+
+    def _on_changes_committed(self, errors):
+        for obj, error in errors:
+            print("Failed to write to the device: {}".format(error.message))
+
+    def reset(self):
+        # Every widget showing a staged value is refreshed through the
+        # change set's "changed" signal
+        self._changes.reset()
+
+    def _add_profile_page(self, idx, builder=None):
+        if builder is None:
+            builder = Gtk.Builder()
+            objects = ["piper-box", "piper-nresolutions-adjustment"]
+            builder.add_objects_from_resource("/org/freedesktop/Piper/piper.ui", objects)
+
+        profile = self._ratbag_device.profiles[idx]
+        page = ProfilePage(builder, profile, self._changes, self._actions,
+                           self._show_btnmap_dialog)
+        self._profile_pages[idx] = page
+        self._stack.add_named(page.widget, "profile{}".format(idx))
+        page.widget.show()
+        return page
+
+    def _on_build_profile_pages(self):
+        # One page per idle callback so the UI stays responsive
+        for idx, page in enumerate(self._profile_pages):
+            if page == None:
+                self._add_profile_page(idx)
+                return True
+        self._build_source = None
+        return False
+
+    def _init_profile_buttons(self, device):
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        Gtk.StyleContext.add_class(box.get_style_context(), "linked")
+
         profiles = device.profiles
         if len(profiles) > 1:
-            box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-            Gtk.StyleContext.add_class(box.get_style_context(), "linked")
-
-            for i, p in enumerate(profiles):
+            for i in range(len(profiles)):
                 button = Gtk.ToggleButton("Profile {}".format(i))
+                button.set_active(i == self._current_profile.index)
                 box.add(button)
                 self._profile_buttons.append(button)
-            hb.pack_start(box)
 
-        hb.show_all()
+        return box
 
-    def _fetch_ratbag_device(self):
-        """
-        Get the first ratbag device available. If there are multiple
-        devices, an error message is printed and we default to the first
-        one.
-        Otherwise, an error is shown and we return None.
-        """
-        try:
-            ratbag = Ratbagd()
-        except RatbagdDBusUnavailable:
-            ratbag = None
+    def _connect_signals(self):
+        for i, b in enumerate(self._profile_buttons):
+            self._bindings.connect(b, "toggled", self.on_button_profile_toggled, i)
 
-        if ratbag == None:
-            self._show_error("Can't connect to ratbagd on DBus. That's quite unfortunate.")
-            return None
-        if len(ratbag.devices) == 0:
-            self._show_error("Could not find any devices. Do you have anything vaguely mouse-looking plugged in?")
-            return None
+    def on_button_profile_toggled(self, widget, idx):
+        if not widget.get_active():
+            return
 
-        if len(ratbag.devices) > 1:
-            print("Ooops, can't deal with more than one device. My bad.")
-            for d in ratbag.devices[1:]:
-                print("Ignoring device {}".format(d.name))
+        for b in self._profile_buttons:
+            if b != widget:
+                with self._bindings.blocked(b):
+                    b.set_active(False)
 
-        d = ratbag.devices[0]
-        p = d.profiles
-        if len(p) == 1 and len(p[0].resolutions) == 1:
-            self._show_error("Device {} does not support switchable resolutions".format(d.name))
-            return None
+        self._current_profile = self._ratbag_device.profiles[idx]
+        if self._profile_pages[idx] == None:
+            self._add_profile_page(idx)
+        self._stack.set_visible_child_name("profile{}".format(idx))
+
+    def on_btnmap_changed(self, widget, button):
+        b = self._dialog_builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
+        self._changes.set(button, "button_mapping", b)
 
-        return d
+    def _custommap_combo_value(self):
+        combo = self._dialog_builder.get_object("piper-btnmap-custommap-combo")
+        tree_iter = combo.get_active_iter()
+        if tree_iter != None:
+            model = combo.get_model()
+            val = model[tree_iter][1]
+            return val
+        return None
+
+    def on_custommap_changed(self, widget, button):
+        radio = self._dialog_builder.get_object("piper-btnmap-custommap-radio")
+        radio.set_active(True)
+
+        val = self._custommap_combo_value()
+        if val:
+            self._changes.set(button, "special", val)
+
+    def on_actiontype_changed_button(self, widget, button):
+        if not widget.get_active():
+            return
+
+        b = self._dialog_builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
+        self._changes.set(button, "button_mapping", b)
+
+    def on_actiontype_changed_key(self, widget, button):
+        if not widget.get_active():
+            return
+
+        keys = self._key_editor.keys
+        if len(keys) > 0 and keys[0] != 0:
+            self._changes.set(button, "key", keys)
+        else:
+            # No key yet, the next one pressed is mapped
+            self._key_editor.start()
+
+    def on_key_captured(self, keys, button):
+        radio = self._dialog_builder.get_object("piper-btnmap-keymap-radio")
+        if radio.get_active():
+            self.on_actiontype_changed_key(radio, button)
+        else:
+            radio.set_active(True)
+
+    def on_actiontype_changed_macro(self, widget, button):
+        if not widget.get_active():
+            return
+
+        # An empty macro does nothing, wait for one to be recorded. Unless
+        # the button's macro was cleared, that is staged like any other.
+        macro = self._macro_editor.macro
+        if len(macro) > 0 or self._changes.get(button, "action_type") == "macro":
+            self._changes.set(button, "macro", macro.to_list())
+
+    def on_macro_recorded(self, macro, button):
+        radio = self._dialog_builder.get_object("piper-btnmap-keyseqmap-radio")
+        if radio.get_active():
+            self.on_actiontype_changed_macro(radio, button)
+        else:
+            radio.set_active(True)
+
+    def on_actiontype_changed_special(self, widget, button):
+        if not widget.get_active():
+            return
+
+        val = self._custommap_combo_value()
+        if val:
+            self._changes.set(button, "special", val)
+
+
+class KeyEditor(object):
+    """The key part of the button mapping dialog. While its button is
+    active, the next key pressed is captured along with the modifiers held
+    down, then on_captured(keys) is called with the keycode followed by the
+    modifiers' keycodes. A modifier pressed and released on its own is
+    captured as key."""
+
+    def __init__(self, builder, bindings, actions, keys, on_captured):
+        self._actions = actions
+        self._on_captured = on_captured
+        self._modifiers = set()
+        self._button = builder.get_object("piper-btnmap-keymap-button")
+        self.keys = list(keys)
+
+        with bindings.blocked(self._button):
+            self._button.set_active(False)
+        self._update_label()
+        bindings.connect(self._button, "toggled", self.on_toggled)
+        dialog = builder.get_object("piper-btnmap-dialog")
+        bindings.connect(dialog, "key-press-event", self.on_key_event, True)
+        bindings.connect(dialog, "key-release-event", self.on_key_event, False)
+
+    def _update_label(self):
+        if self._button.get_active():
+            text = "Press a key..."
+        elif len(self.keys) > 0 and self.keys[0] != 0:
+            text = self._actions.key_label(self.keys)
+        else:
+            text = "Click to set a key"
+        self._button.set_label(text)
+
+    def start(self):
+        self._button.set_active(True)
+
+    def stop(self):
+        self._button.set_active(False)
+
+    def _capture(self, keys):
+        self.keys = keys
+        self.stop()
+        self._on_captured(keys)
+
+    def on_toggled(self, widget):
+        self._modifiers = set()
+        self._update_label()
+
+    def on_key_event(self, widget, event, pressed):
+        if not self._button.get_active():
+            return False
+
+        # The X11 and Wayland keycodes are the kernel's plus 8
+        keycode = event.hardware_keycode - 8
+        if self._actions.is_modifier(keycode):
+            if pressed:
+                self._modifiers.add(keycode)
+            elif self._modifiers == {keycode}:
+                self._capture([keycode])
+            else:
+                self._modifiers.discard(keycode)
+        elif pressed:
+            self._capture([keycode] + self._actions.sort_modifiers(self._modifiers))
+        return True
+
+
+class MacroEditor(object):
+    """The macro part of the button mapping dialog. While the record button
+    is active, the dialog's key events are recorded into the macro; once
+    it is released or the macro is cleared, on_recorded(macro) is called.
+    The list shows one row per event, recording only adds or updates the
+    rows of the events that changed."""
+
+    def __init__(self, builder, bindings, actions, macro, on_recorded):
+        self._actions = actions
+        self._on_recorded = on_recorded
+        self._recorder = None
+        self._listbox = builder.get_object("piper-btnmap-keyseqmap-listbox")
+        self._status = builder.get_object("piper-btnmap-keyseqmap-status-label")
+        self._record_button = builder.get_object("piper-btnmap-keyseqmap-record-button")
+        self._rows = []
+        self._set_macro(macro)
+
+        with bindings.blocked(self._record_button):
+            self._record_button.set_active(False)
+        bindings.connect(self._record_button, "toggled", self.on_record_toggled)
+        clear = builder.get_object("piper-btnmap-keyseqmap-clear-button")
+        bindings.connect(clear, "clicked", self.on_clear_clicked)
+        dialog = builder.get_object("piper-btnmap-dialog")
+        bindings.connect(dialog, "key-press-event", self.on_key_event, True)
+        bindings.connect(dialog, "key-release-event", self.on_key_event, False)
+
+    def _set_macro(self, macro):
+        self.macro = macro
+        # The listbox is shared with the previous runs of the dialog
+        for row in self._listbox.get_children():
+            row.destroy()
+        self._rows = []
+        self._update_rows(0)
+
+    def _update_rows(self, first):
+        for i in range(first, len(self.macro)):
+            text = format_event(self.macro[i], self._actions.key_name)
+            if i < len(self._rows):
+                self._rows[i].set_text(text)
+            else:
+                l = Gtk.Label(text)
+                l.set_xalign(0)
+                l.set_margin_left(12)
+                l.show()
+                self._listbox.add(l)
+                self._rows.append(l)
+
+        status = "{}/{} events".format(len(self.macro), self.macro.max_events)
+        if self.macro.full:
+            status = "Full, " + status
+        self._status.set_text(status)
+
+    def stop(self):
+        """Stops recording, if recording."""
+        self._record_button.set_active(False)
+
+    def on_record_toggled(self, widget):
+        if widget.get_active():
+            self._set_macro(Macro())
+            self._recorder = MacroRecorder(self.macro)
+        elif self._recorder != None:
+            self._recorder = None
+            # Keys still down when the recording stopped
+            first = self.macro.finish()
+            if first != None:
+                self._update_rows(first)
+            self._on_recorded(self.macro)
+
+    def on_clear_clicked(self, widget):
+        # Drop what is being recorded rather than staging it on stop()
+        self._recorder = None
+        self.stop()
+        self._set_macro(Macro())
+        self._on_recorded(self.macro)
+
+    def on_key_event(self, widget, event, pressed):
+        if self._recorder == None:
+            return False
+
+        # The X11 and Wayland keycodes are the kernel's plus 8
+        first = self._recorder.key_event(pressed, event.hardware_keycode - 8)
+        if first != None:
+            self._update_rows(first)
+        return True
+
+
+class ProfilePage(object):
+    """The resolution, report rate and button widgets of a single profile.
+    Once built, the page updates the widgets individually as the profile's
+    values change, staged or on the device."""
+
+    # The resolution range for devices that don't tell us theirs
+    RESOLUTION_RANGE = (50, 12000)
+
+    LED_MODES = [
+        (RatbagdLed.LED_MODE_OFF, "Off"),
+        (RatbagdLed.LED_MODE_ON, "On"),
+        (RatbagdLed.LED_MODE_CYCLE, "Color cycle"),
+        (RatbagdLed.LED_MODE_BREATHING, "Breathing"),
+    ]
+
+    def __init__(self, builder, profile, changes, actions, show_btnmap_dialog):
+        self._builder = builder
+        self._profile = profile
+        self._changes = changes
+        self._actions = actions
+        self._show_btnmap_dialog = show_btnmap_dialog
+        self._bindings = SignalBindings()
+        self._watches = {}
+        self._button_function_labels = []
+        self._led_widgets = []
+
+        self.widget = builder.get_object("piper-box")
+
+        self._init_report_rate(builder, profile)
+        self._init_resolution(builder, profile)
+        self._init_buttons(builder, profile)
+        self._init_leds(builder, profile)
+
+        self._update_from_device()
+        self._connect_signals()
+        self._bindings.connect(self._changes, "changed", self._on_change_staged)
+
+    def destroy(self):
+        """Disconnects the page from the profile and the change set, called
+        when the page is replaced."""
+        self._bindings.disconnect_all()
+        self._watches = {}
+
+    def _watch(self, obj, prop, func, *args):
+        """Calls func(*args) whenever the value of the given property of a
+        ratbagd object changes, either staged in the change set or on the
+        device."""
+        self._watches.setdefault((obj._objpath, prop), []).append((func, args))
+        self._bindings.connect(obj, "notify::{}".format(prop.replace("_", "-")),
+                               lambda obj, pspec: func(*args))
+
+    def _on_change_staged(self, changes, obj, prop):
+        for func, args in self._watches.get((obj._objpath, prop), []):
+            func(*args)
 
     def _init_resolution(self, builder, profile):
-        res = profile.resolutions
         nres = len(profile.resolutions)
 
+        # One spinbutton per resolution, bound by the resolution's limits
+        box = builder.get_object("piper-xres-box")
         self._resolution_buttons = []
         self._resolution_adjustments = []
-        for i in range(0, 5):
-            sb = builder.get_object("piper-xres-spinbutton{}".format(i + 1))
+        self._resolution_limits = []
+        for r in profile.resolutions:
+            limits = (r.min_res, r.max_res)
+            if (None in limits or limits[0] <= 0 or limits[1] <= 0 or
+                    limits[0] > limits[1]):
+                limits = self.RESOLUTION_RANGE
+            adj = Gtk.Adjustment(lower=limits[0], upper=limits[1],
+                                 step_increment=50, page_increment=500)
+            sb = Gtk.SpinButton(adjustment=adj, climb_rate=50,
+                                orientation=Gtk.Orientation.VERTICAL)
+            box.pack_start(sb, False, True, 0)
+            # pages built after startup are only shown with show()
+            sb.show()
             self._resolution_buttons.append(sb)
-            adj = builder.get_object("piper-xres-adjustment{}".format(i + 1))
             self._resolution_adjustments.append(adj)
+            self._resolution_limits.append(limits)
 
         nres_spin = builder.get_object("piper-nresolutions-spin")
         self._nres_button = nres_spin
@@ -199,12 +821,8 @@ class Piper(Gtk.Window):
     def _init_report_rate(self, builder, profile):
         # Note: we simplify here, the UI only allows one report rate and it
         # will be applied to all resolutions
-        rate = profile.active_resolution.report_rate
         r500 = builder.get_object("piper-report-rate-500")
         r1000 = builder.get_object("piper-report-rate-1000")
-        r500.connect("toggled", self.on_resolution_rate_changed, 500)
-        r1000.connect("toggled", self.on_resolution_rate_changed, 1000)
-
         self._rate_buttons = { 500 : r500,
                                1000 : r1000 }
 
@@ -213,14 +831,12 @@ class Piper(Gtk.Window):
         lb.remove(builder.get_object("piper-button-listboxrow"))
 
         for i, b in enumerate(profile.buttons):
-            lbr = self._init_button_row(b)
+            lbr = self._init_button_row(b, i)
             lb.add(lbr)
 
-        self._set_button_row_function_labels(profile)
-
         lb.show_all()
 
-    def _init_button_row(self, button):
+    def _init_button_row(self, button, idx):
         # FIXME: can't I duplicate this from builder?
         lbr = Gtk.ListBoxRow()
         lbr.height_request = 80
@@ -243,222 +859,431 @@ class Piper(Gtk.Window):
         self._button_function_labels.append(l2)
 
         btn = Gtk.Button("...")
-        btn.connect("clicked", self.on_button_click, button)
+        btn.connect("clicked", self.on_button_click, idx)
         box.add(btn)
         lbr.add(box)
         return lbr
 
-    def _set_button_row_function_labels(self, profile):
-        buttons = profile.buttons
-        for l, button in zip(self._button_function_labels, buttons):
-            action = button.action_type
-            if action == "button":
-                text = "Button {} click".format(button.button_mapping)
-            elif action == "key":
-                text = "Key event: {}".format(button.key[0])
-            elif action == "macro":
-                text = "Macro (unsupported, sorry)"
-            elif action == "special":
-                v = button.special
-                c = self._builder.get_object("piper-btnmap-custommap-combo")
-                tree = c.get_model()
-                it = tree.get_iter_first()
-                while it:
-                    if tree.get_value(it, 1) == v:
-                        text = "{}".format(tree[it][0])
-                        break;
-                    it = tree.iter_next(it)
-
-                if it == None:
-                    text = "Unknown special {}".format(v)
-            else:
-                text = "!help, I'm confused!"
+    def _init_leds(self, builder, profile):
+        if len(profile.leds) == 0:
+            for name in ("piper-leds-label", "piper-frame-leds"):
+                w = builder.get_object(name)
+                w.set_no_show_all(True)
+                w.set_visible(False)
+            return
+
+        lb = builder.get_object("piper-leds-listbox")
+        for i, led in enumerate(profile.leds):
+            lbr = self._init_led_row(led, i)
+            # pages built after startup are only shown with show()
+            lbr.show_all()
+            lb.add(lbr)
 
-            l.set_text(text)
+    def _init_led_row(self, led, idx):
+        lbr = Gtk.ListBoxRow()
+        lbr.set_activatable(False)
+        lbr.set_selectable(False)
+        grid = Gtk.Grid()
+        grid.set_column_spacing(12)
+        grid.set_row_spacing(6)
+        grid.set_margin_left(12)
+        grid.set_margin_right(10)
+        grid.set_margin_top(8)
+        grid.set_margin_bottom(8)
+
+        preview = LedPreview()
+        preview.set_valign(Gtk.Align.CENTER)
+        grid.attach(preview, 0, 0, 1, 3)
+
+        mode = Gtk.ComboBoxText()
+        for value, label in self.LED_MODES:
+            mode.append(str(value), label)
+        color = Gtk.ColorButton()
+        color.set_use_alpha(False)
+        rate = Gtk.SpinButton.new_with_range(100, 20000, 100)
+        brightness = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, 0, 255, 1)
+        brightness.set_hexpand(True)
+        brightness.set_draw_value(False)
+
+        for row, (text, w) in enumerate((("Mode", mode),
+                                         ("Effect rate (Hz)", rate),
+                                         ("Brightness", brightness))):
+            l = Gtk.Label(text)
+            l.set_xalign(0)
+            grid.attach(l, 1, row, 1, 1)
+            grid.attach(w, 2, row, 1, 1)
+        grid.attach(color, 3, 0, 1, 1)
+
+        lbr.add(grid)
+        self._led_widgets.append((preview, mode, color, rate, brightness))
+        return lbr
+
+    def _refresh_button_label(self, idx):
+        button = self._profile.buttons[idx]
+        action = self._changes.get(button, "action_type")
+        if action == "button":
+            text = "Button {} click".format(self._changes.get(button, "button_mapping"))
+        elif action == "key":
+            text = "Key event: {}".format(self._actions.key_label(self._changes.get(button, "key")))
+        elif action == "macro":
+            macro = self._changes.get(button, "macro")
+            text = "Macro: {}".format(format_macro(macro[:8], self._actions.key_name))
+            if len(macro) > 8:
+                text += " ..."
+        elif action == "special":
+            v = self._changes.get(button, "special")
+            text = self._actions.special_label(v)
+            if text == None:
+                text = "Unknown special {}".format(v)
+        else:
+            text = "!help, I'm confused!"
 
+        self._button_function_labels[idx].set_text(text)
+
+    def _refresh_report_rate(self):
+        rate = self._changes.get(self._profile.active_resolution, "report_rate")
+        for r, b in self._rate_buttons.items():
+            with self._bindings.blocked(b):
+                b.set_active(r == rate)
+
+    def _refresh_led(self, idx):
+        led = self._profile.leds[idx]
+        mode = self._changes.get(led, "mode")
+        color = self._changes.get(led, "color")
+        rate = self._changes.get(led, "effect_rate")
+        brightness = self._changes.get(led, "brightness")
+
+        preview, mode_combo, color_button, rate_spin, brightness_scale = self._led_widgets[idx]
+        with self._bindings.blocked(mode_combo, color_button, rate_spin, brightness_scale):
+            mode_combo.set_active_id(str(mode))
+            color_button.set_rgba(Gdk.RGBA(*[c / 255.0 for c in color], 1.0))
+            rate_spin.set_value(rate)
+            brightness_scale.set_value(brightness)
+
+        color_button.set_sensitive(mode in (RatbagdLed.LED_MODE_ON, RatbagdLed.LED_MODE_BREATHING))
+        rate_spin.set_sensitive(mode in (RatbagdLed.LED_MODE_CYCLE, RatbagdLed.LED_MODE_BREATHING))
+        brightness_scale.set_sensitive(mode != RatbagdLed.LED_MODE_OFF)
+        preview.set_state(mode, color, rate, brightness)
+
+    def _refresh_resolution(self, idx):
+        # The new value may move its neighbours' bounds too, nothing else
+        self._adjust_sensitivity_ranges(range(idx - 1, idx + 2))
 
     def _connect_signals(self):
         """
-        Connect signals for those buttons that cause a write to the device.
-        We do this separate so we can disconnect them again before we update
-        the profile from the device. Otherwise, any widget.set_value() will
-        trigger the matching callback and tries to write to the device.
+        Connect signals for those widgets that stage a change for the
+        device. Updates coming from the device block them, see
+        SignalBindings.blocked().
         """
-        s = []
-        for i, b in enumerate(self._resolution_buttons):
-            s.append(b.connect("value-changed", self.on_resolutions_changed, i))
+        for r, b in self._rate_buttons.items():
+            self._bindings.connect(b, "toggled", self.on_resolution_rate_changed, r)
 
-        s.append(self._nres_button.connect("value-changed", self.on_nresolutions_changed, self._builder))
+        for i, b in enumerate(self._resolution_buttons):
+            self._bindings.connect(b, "value-changed", self.on_resolutions_changed, i)
 
-        for i, b in enumerate(self._profile_buttons):
-            s.append(b.connect("toggled", self.on_button_profile_toggled, i))
+        b = self._nres_button
+        self._bindings.connect(b, "value-changed", self.on_nresolutions_changed, self._builder)
 
-        self._signal_ids = []
-
-    def _disconnect_signals(self):
-        """
-        Disconnect all previously connected signals.
-        """
-        for s in self._signal_ids:
-            self.disconnect(s)
-        self._signal_ids = []
+        for i, (preview, mode, color, rate, brightness) in enumerate(self._led_widgets):
+            self._bindings.connect(mode, "changed", self.on_led_mode_changed, i)
+            self._bindings.connect(color, "color-set", self.on_led_color_set, i)
+            self._bindings.connect(rate, "value-changed", self.on_led_effect_rate_changed, i)
+            self._bindings.connect(brightness, "value-changed", self.on_led_brightness_changed, i)
 
     def on_resolution_rate_changed(self, widget, new_rate):
         if not widget.get_active():
             return
 
-        res = self._current_profile.active_resolution.report_rate = new_rate
+        resolution = self._profile.active_resolution
+        self._changes.set(resolution, "report_rate", new_rate)
 
     def on_nresolutions_changed(self, widget, builder):
         nres = widget.get_value_as_int()
-        for i in range(0, 5):
-            sb = builder.get_object("piper-xres-spinbutton{}".format(i + 1))
+        for i, sb in enumerate(self._resolution_buttons):
             sb.set_sensitive(nres > i)
 
         self._adjust_sensitivity_ranges()
 
     def on_resolutions_changed(self, widget, index):
-        self._adjust_sensitivity_ranges()
-        value = widget.get_value()
-        self._current_profile.resolutions[index].resolution = (value, value)
-
-    def on_button_save_clicked(self, widget):
-        print("FIXME: I should save this to the device now")
-
-    def on_button_reset_clicked(self, widget):
-        self._update_from_device()
-
-    def on_button_profile_toggled(self, widget, idx):
-        if not widget.get_active():
-            return
-
-        self._disconnect_signals()
-
-        for b in self._profile_buttons:
-            if b != widget:
-                b.set_active(False)
-
-        self._current_profile = self._ratbag_device.profiles[idx]
-        self._update_from_device()
-
-        if self._initialized:
-            self._connect_signals()
-
-    def on_button_click(self, widget, button):
-        self._show_btnmap_dialog(button)
-
-    def on_btnmap_changed(self, widget, button):
-        b = self._builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
-        button.button = b
-
-    def _custommap_combo_value(self):
-        combo = self._builder.get_object("piper-btnmap-custommap-combo")
-        tree_iter = combo.get_active_iter()
-        if tree_iter != None:
-            model = combo.get_model()
-            val = model[tree_iter][1]
-            return val
-        return None
-
-    def on_custommap_changed(self, widget, button):
-        radio = self._builder.get_object("piper-btnmap-custommap-radio")
-        radio.set_active(True)
-
-        val = self._custommap_combo_value()
-        if val:
-            button.special = val
-
-    def on_actiontype_changed_button(self, widget, button):
-        if not widget.get_active():
-            return
-
-        b = self._builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
-        button.button = b
-
-    def on_actiontype_changed_key(self, widget, button):
-        if not widget.get_active():
-            return
-        print("FIXME: change to key")
-
-    def on_actiontype_changed_macro(self, widget, button):
-        if not widget.get_active():
-            return
-        print("FIXME: change to macro")
-
-    def on_actiontype_changed_special(self, widget, button):
-        val = self._custommap_combo_value()
-        if val:
-            button.special = val
-
-    def _adjust_sensitivity_ranges(self):
+        value = widget.get_value_as_int()
+        resolution = self._profile.resolutions[index]
+        # The bounds are updated through _refresh_resolution()
+        self._changes.set(resolution, "resolution", (value, value))
+
+    # The LED changes are only staged, the preview shows them right away
+    # and they are written to the device on save like everything else
+    def on_led_mode_changed(self, widget, idx):
+        mode = widget.get_active_id()
+        if mode != None:
+            self._changes.set(self._profile.leds[idx], "mode", int(mode))
+
+    def on_led_color_set(self, widget, idx):
+        rgba = widget.get_rgba()
+        color = tuple(int(round(c * 255)) for c in (rgba.red, rgba.green, rgba.blue))
+        self._changes.set(self._profile.leds[idx], "color", color)
+
+    def on_led_effect_rate_changed(self, widget, idx):
+        self._changes.set(self._profile.leds[idx], "effect_rate", widget.get_value_as_int())
+
+    def on_led_brightness_changed(self, widget, idx):
+        self._changes.set(self._profile.leds[idx], "brightness", int(widget.get_value()))
+
+    def on_button_click(self, widget, idx):
+        self._show_btnmap_dialog(self._profile.buttons[idx])
+
+    @staticmethod
+    def _sensitivity_bounds(values, limits, nres, indices):
         """
-        Align the five sensitivity ranges so that the right-most one can
-        go to 1200, the left-most one to 200. In between they're bound by
-        the previous/next one so the order is always ascending
+        Returns the (lower, upper) bounds of the resolution values at the
+        given indices. All are bound by the (min, max) limits of their
+        resolution, the first nres ones also by their neighbours so the
+        order is always ascending. values maps the indices and their
+        neighbours' to the values, a list of all of them will do.
+        A value already outside its bounds widens them rather than being
+        clamped, the spinbutton has to show what is staged.
         """
-        nres = self._nres_button.get_value_as_int() - 1
-
-        min, max = 200, 12000
-
-        adj = self._resolution_adjustments
-        while nres >= 0:
-            a1 = adj[nres]
-            a1.set_upper(max)
-            v = int(a1.get_value())
-            if v != 0:
-                max = v
-
-            if nres > 0:
-                a2 = adj[nres - 1]
-                min = a2.get_value()
-            else:
-                min = 200
-
-            a1.set_lower(min)
-            nres -= 1
+        bounds = []
+        for i in indices:
+            value = values[i]
+            lower, upper = limits[i]
+            if i < nres:
+                if i > 0:
+                    lower = max(lower, values[i - 1])
+                if i + 1 < nres and values[i + 1] != 0:
+                    upper = min(upper, values[i + 1])
+                upper = max(lower, upper)
+            bounds.append((min(lower, value), max(upper, value)))
+        return bounds
+
+    def _adjust_sensitivity_ranges(self, indices=None):
+        """
+        Updates the value and the range of the resolution spinbuttons at
+        the given indices, all if None, from the staged values. All bounds
+        are computed first, then applied with the adjustments'
+        notifications frozen and only where they differ, so one edit
+        doesn't cascade into a series of updates.
+        """
+        resolutions = self._profile.resolutions
+        if indices is None:
+            indices = range(len(resolutions))
+        indices = [i for i in indices if 0 <= i < len(resolutions)]
+        nres = self._nres_button.get_value_as_int()
+        values = {}
+        for i in indices:
+            for j in range(max(i - 1, 0), min(i + 2, len(resolutions))):
+                if j not in values:
+                    values[j] = self._changes.get(resolutions[j], "resolution")[0]
+        bounds = self._sensitivity_bounds(values, self._resolution_limits, nres, indices)
+
+        adjustments = [self._resolution_adjustments[i] for i in indices]
+        values = [values[i] for i in indices]
+        for adj in adjustments:
+            adj.freeze_notify()
+        with self._bindings.blocked(*[self._resolution_buttons[i] for i in indices]):
+            for adj, value, (lower, upper) in zip(adjustments, values, bounds):
+                if (adj.get_value(), adj.get_lower(), adj.get_upper()) == (value, lower, upper):
+                    continue
+                adj.configure(value, lower, upper, adj.get_step_increment(),
+                              adj.get_page_increment(), adj.get_page_size())
+        for adj in adjustments:
+            adj.thaw_notify()
 
     def _update_from_device(self):
-        device = self._ratbag_device
-        profile = self._current_profile
-
-        for i, b in enumerate(self._profile_buttons):
-            if device.profiles[i] == self._current_profile:
-                b.set_active(True)
-            else:
-                b.set_active(False)
+        """
+        Update all widgets from the profile. Afterwards, each widget is
+        updated individually when its value changes.
+        """
+        profile = self._profile
 
-        rate = profile.active_resolution.report_rate
-        for r, b in self._rate_buttons.items():
-            b.set_active(r == rate)
+        rate = self._changes.get(profile.active_resolution, "report_rate")
+        self._refresh_report_rate()
+        self._watch(profile, "active_resolution", self._refresh_report_rate)
+        for r in profile.resolutions:
+            self._watch(r, "report_rate", self._refresh_report_rate)
 
         if not rate in self._rate_buttons.keys():
             print("Ooops, rate is {} and I don't know how to deal with that.".format(rate))
             for b in self._rate_buttons.values():
                 b.set_sensitive(False)
 
-        res = profile.resolutions
-        nres = len(res)
+        for i, r in enumerate(profile.resolutions):
+            self._watch(r, "resolution", self._refresh_resolution, i)
 
-        for i, b in enumerate(self._resolution_buttons):
-            if i >= nres:
-                b.set_visible(False)
-                continue
+        self._nres_button.set_value(len(profile.resolutions))
+        self._adjust_sensitivity_ranges()
 
-            xres = res[i].resolution[0]
-            b.set_value(xres)
+        for i, button in enumerate(profile.buttons):
+            self._refresh_button_label(i)
+            for prop in ("action_type", "button_mapping", "special", "key", "macro"):
+                self._watch(button, prop, self._refresh_button_label, i)
+
+        for i, led in enumerate(profile.leds):
+            self._refresh_led(i)
+            for prop in ("mode", "color", "effect_rate", "brightness"):
+                self._watch(led, prop, self._refresh_led, i)
 
-        self._nres_button.set_value(nres)
-        self._adjust_sensitivity_ranges()
-        self._set_button_row_function_labels(profile)
 
 class PiperImage(Gtk.EventBox):
-    def __init__(self, path):
+    """The device image, emitting button-clicked with the button index when
+    a button drawn on it is clicked and highlighting the button under the
+    pointer. Works on the Gtk.Image it is given, shown at a fixed width."""
+
+    __gsignals__ = {
+        "button-clicked": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+    }
+
+    def __init__(self, image, width):
         Gtk.EventBox.__init__(self)
-        self._image = Gtk.Image()
-        self._image.set_from_file(path)
+        self._image = image
+        self._width = width
+        self._index = None
+        self._hover = None
         self.add(self._image)
+        self.add_events(Gdk.EventMask.POINTER_MOTION_MASK |
+                        Gdk.EventMask.LEAVE_NOTIFY_MASK)
         self.connect("button-press-event", self.on_button_clicked)
+        self.connect("motion-notify-event", self.on_motion)
+        self.connect("leave-notify-event", self.on_leave)
+        self.connect_after("draw", self.on_draw)
+
+    def set_hit_index(self, index):
+        """Sets the piper.hittest.HitIndex of the shown SVG, or None."""
+        self._index = index
+        self._set_hover(None)
+
+    def _transform(self):
+        """Returns (scale, x offset, y offset) from SVG units to widget
+        coordinates. The image is centered in the allocation."""
+        index = self._index
+        scale = self._width / index.width
+        alloc = self.get_allocation()
+        return (scale,
+                (alloc.width - index.width * scale) / 2,
+                (alloc.height - index.height * scale) / 2)
+
+    def _lookup(self, x, y):
+        if self._index == None or self._index.width == 0:
+            return None
+        scale, ox, oy = self._transform()
+        return self._index.lookup((x - ox) / scale, (y - oy) / scale)
+
+    def _set_hover(self, button):
+        if button != self._hover:
+            self._hover = button
+            self.queue_draw()
 
     def on_button_clicked(self, widget, event):
-        print(event.x)
+        button = self._lookup(event.x, event.y)
+        if button != None:
+            self.emit("button-clicked", button)
+
+    def on_motion(self, widget, event):
+        self._set_hover(self._lookup(event.x, event.y))
+
+    def on_leave(self, widget, event):
+        self._set_hover(None)
+
+    def on_draw(self, widget, cr):
+        if self._hover == None:
+            return False
+        scale, ox, oy = self._transform()
+        cr.set_source_rgba(0.2, 0.5, 1.0, 0.3)
+        for x, y, w, h in self._index.boxes(self._hover):
+            cr.rectangle(ox + x * scale, oy + y * scale, w * scale, h * scale)
+        cr.fill()
+        return False
+
+
+class LedPreview(Gtk.DrawingArea):
+    """Shows how a led looks with the given mode, color and brightness,
+    without writing anything to the device. The cycle and breathing
+    effects are animated from the frame clock, so they run at the display's
+    refresh rate and only while the preview is mapped. The led's glow is
+    rendered once per size into a cached surface and only tinted per
+    frame."""
+
+    SIZE = 48
+
+    # The device's effect rate in Hz is far too fast to watch. The preview
+    # runs one effect period in PERIOD_SCALE / effect rate seconds, i.e. two
+    # seconds at the default of 1000 Hz, so faster still looks faster.
+    PERIOD_SCALE = 2000.0
 
+    def __init__(self):
+        Gtk.DrawingArea.__init__(self)
+        self.set_size_request(self.SIZE, self.SIZE)
+        self._mode = RatbagdLed.LED_MODE_OFF
+        self._color = (0, 0, 0)
+        self._period = 1.0
+        self._brightness = 0
+        self._phase = 0.0
+        self._last_frame = None
+        self._tick_id = None
+        self._glow = None
+        self.connect("draw", self.on_draw)
+        self.connect("map", self._update_ticking)
+        self.connect("unmap", self._update_ticking)
+
+    def set_state(self, mode, color, effect_rate, brightness):
+        self._mode = mode
+        self._color = color
+        self._period = self.PERIOD_SCALE / max(effect_rate, 1)
+        self._brightness = brightness
+        self._update_ticking()
+        self.queue_draw()
+
+    def _update_ticking(self, *args):
+        animated = self._mode in (RatbagdLed.LED_MODE_CYCLE, RatbagdLed.LED_MODE_BREATHING)
+        if animated and self.get_mapped():
+            if self._tick_id == None:
+                self._last_frame = None
+                self._tick_id = self.add_tick_callback(self._on_tick)
+        elif self._tick_id != None:
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+
+    def _on_tick(self, widget, frame_clock):
+        # Advance the phase rather than deriving it from the time, so a
+        # changed effect rate doesn't make the animation jump
+        now = frame_clock.get_frame_time()
+        if self._last_frame != None:
+            self._phase = (self._phase + (now - self._last_frame) / 1e6 / self._period) % 1.0
+        self._last_frame = now
+        self.queue_draw()
+        return GLib.SOURCE_CONTINUE
+
+    def _current_color(self):
+        """Returns the (r, g, b, a) the led has in the current frame."""
+        alpha = self._brightness / 255.0
+        if self._mode == RatbagdLed.LED_MODE_CYCLE:
+            r, g, b = colorsys.hsv_to_rgb(self._phase, 1.0, 1.0)
+        else:
+            r, g, b = [c / 255.0 for c in self._color]
+        if self._mode == RatbagdLed.LED_MODE_BREATHING:
+            alpha *= 0.5 - 0.5 * math.cos(2 * math.pi * self._phase)
+        return (r, g, b, alpha)
+
+    def _glow_surface(self, cr, width, height):
+        if self._glow == None or self._glow[:2] != (width, height):
+            surface = cr.get_target().create_similar(cairo.CONTENT_ALPHA, width, height)
+            c = cairo.Context(surface)
+            x, y = width / 2.0, height / 2.0
+            gradient = cairo.RadialGradient(x, y, 0, x, y, min(x, y))
+            gradient.add_color_stop_rgba(0.0, 0, 0, 0, 1.0)
+            gradient.add_color_stop_rgba(0.4, 0, 0, 0, 0.9)
+            gradient.add_color_stop_rgba(1.0, 0, 0, 0, 0.0)
+            c.set_source(gradient)
+            c.paint()
+            self._glow = (width, height, surface)
+        return self._glow[2]
+
+    def on_draw(self, widget, cr):
+        glow = self._glow_surface(cr, self.get_allocated_width(), self.get_allocated_height())
+
+        # The unlit led, so an led that is off is still visible
+        cr.set_source_rgba(0.5, 0.5, 0.5, 0.3)
+        cr.mask_surface(glow, 0, 0)
+        if self._mode != RatbagdLed.LED_MODE_OFF:
+            cr.set_source_rgba(*self._current_color())
+            cr.mask_surface(glow, 0, 0)
+        return False
@@ -21,50 +21,942 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from collections.abc import Sequence
 from gi.repository import Gio, GLib, GObject
 
 
+# ratbagd runs on the system bus. PIPER_RATBAGD_BUS=session connects to a
+# ratbagd on the session bus instead, e.g. tools/ratbagd-mock.py.
+if os.environ.get("PIPER_RATBAGD_BUS") == "session":
+    _BUS_TYPE = Gio.BusType.SESSION
+else:
+    _BUS_TYPE = Gio.BusType.SYSTEM
+
+
 class RatbagdDBusUnavailable(BaseException):
     """Signals DBus is unavailable or the ratbagd daemon is not available."""
     pass
 
 
+def flush_writes(callback=None):
+    """Sends all writes still held back for coalescing to the device right
+    away. Once all writes sent so far have completed, callback() is
+    invoked, immediately if there are none.
+
+    @param callback The function to call on completion, or None
+    """
+    _RatbagdDBus._write_queue.flush(callback)
+
+
+def proxy_count():
+    """Returns the number of D-Bus proxies created so far by this module,
+    synchronously or not. Since child objects are only created when first
+    accessed, this can be used to check how many objects were actually
+    needed. See async_proxy_count()."""
+    return _RatbagdDBus._proxy_count
+
+
+def async_proxy_count():
+    """Returns how many of the proxy_count() proxies were created without
+    blocking, by the background tree loader."""
+    return _RatbagdDBus._async_proxy_count
+
+
+def use_worker_thread():
+    """Moves the D-Bus traffic of this module into a worker thread running
+    its own GLib.MainContext. Proxies are created, and methods called, in
+    that thread; the results and the proxies' signals are delivered back
+    to the main context through GLib.idle_add(), so callbacks and notify::
+    handlers keep running in the main thread. A device that takes seconds
+    to answer an async call then doesn't hold up the main loop.
+
+    The API stays the same, but the synchronous calls (e.g. the property
+    setters) still block their caller until ratbagd answered; use the
+    *_async() variants from a UI.
+
+    Must be called before any object is created. Also enabled at startup
+    if PIPER_RATBAGD_THREAD is set to 1.
+    """
+    global _worker
+    if _worker is None:
+        _worker = _RatbagdWorker()
+
+
+def enable_tracing(path=None):
+    """Records every D-Bus call, property read and proxy creation of this
+    module with its object path, payload size, duration and outcome. A
+    summary with per-method counts and latency histograms is written to
+    the given file on exit, or to stderr if path is None or "-".
+
+    Tracing is also enabled at startup if PIPER_RATBAGD_TRACE is set to a
+    file path (or "-").
+
+    @param path The file to write the summary to, or None
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = _RatbagdTracer()
+        atexit.register(_tracer.dump)
+    _tracer.path = path
+
+
+def trace_summary():
+    """Returns the trace summary as string, or None if tracing is not
+    enabled. See enable_tracing()."""
+    if _tracer is None:
+        return None
+    return _tracer.summary()
+
+
+class _RatbagdTracer(object):
+    """Collects the statistics for enable_tracing(). The upper bounds in ms
+    of the histogram buckets are powers of two, the last bucket collects
+    everything slower than that."""
+
+    BUCKETS = [2 ** i for i in range(12)]
+
+    def __init__(self):
+        self.path = None
+        self._stats = OrderedDict()
+        self._paths = {}
+        # Calls are recorded from the worker thread too, see
+        # use_worker_thread()
+        self._lock = threading.Lock()
+
+    def record(self, method, object_path, size, start, error=None):
+        """Records a single call that started at time.monotonic() start."""
+        ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._record(method, object_path, ms, size, error)
+
+    def _record(self, method, object_path, ms, size, error):
+        stats = self._stats.get(method)
+        if stats is None:
+            stats = self._stats[method] = {
+                "count": 0,
+                "errors": 0,
+                "bytes": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "histogram": [0] * (len(self.BUCKETS) + 1),
+            }
+        stats["count"] += 1
+        stats["bytes"] += size
+        stats["total"] += ms
+        stats["max"] = max(stats["max"], ms)
+        if error is not None:
+            stats["errors"] += 1
+        for i, bound in enumerate(self.BUCKETS):
+            if ms < bound:
+                break
+        else:
+            i = len(self.BUCKETS)
+        stats["histogram"][i] += 1
+
+        # Total time per object path, to find slow devices
+        self._paths[object_path] = self._paths.get(object_path, 0.0) + ms
+
+    def summary(self):
+        with self._lock:
+            return self._summary()
+
+    def _summary(self):
+        lines = ["{:32} {:>6} {:>6} {:>8} {:>9} {:>9}".format(
+            "method", "calls", "errors", "bytes", "avg ms", "max ms")]
+        for method, stats in self._stats.items():
+            lines.append("{:32} {:6} {:6} {:8} {:9.2f} {:9.2f}".format(
+                method, stats["count"], stats["errors"], stats["bytes"],
+                stats["total"] / stats["count"], stats["max"]))
+            buckets = ["<{}:{}".format(bound, n)
+                       for bound, n in zip(self.BUCKETS, stats["histogram"]) if n]
+            if stats["histogram"][-1]:
+                buckets.append(">={}:{}".format(self.BUCKETS[-1], stats["histogram"][-1]))
+            lines.append("    ms " + " ".join(buckets))
+
+        lines.append("")
+        lines.append("Slowest object paths (total ms):")
+        slowest = sorted(self._paths.items(), key=lambda p: p[1], reverse=True)
+        for object_path, ms in slowest[:10]:
+            lines.append("  {:9.2f} {}".format(ms, object_path))
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        if self.path is None or self.path == "-":
+            sys.stderr.write(self.summary())
+        else:
+            with open(self.path, "w") as f:
+                f.write(self.summary())
+
+
+_tracer = None
+if os.environ.get("PIPER_RATBAGD_TRACE"):
+    enable_tracing(os.environ["PIPER_RATBAGD_TRACE"])
+
+
+def _run_in_main(func, *args):
+    """Calls func(*args) once from the default main context."""
+    def dispatch():
+        func(*args)
+        return False
+    GLib.idle_add(dispatch, priority=GLib.PRIORITY_DEFAULT)
+
+
+class _RatbagdWorker(object):
+    """The thread for use_worker_thread(). Everything run through invoke()
+    or run_sync() runs with our context as the thread-default context, so
+    the async callbacks and signals of the proxies created there are
+    dispatched in this thread as well. Code running here must not touch
+    our GObjects, it hands its results over with _run_in_main().
+    """
+
+    def __init__(self):
+        self._context = GLib.MainContext()
+        self._loop = GLib.MainLoop(self._context)
+        self._thread = threading.Thread(target=self._run, name="ratbagd")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self._context.push_thread_default()
+        self._loop.run()
+
+    def invoke(self, func, *args):
+        """Calls func(*args) in the worker thread without waiting."""
+        def dispatch(*unused):
+            func(*args)
+            return False
+        source = GLib.idle_source_new()
+        source.set_priority(GLib.PRIORITY_DEFAULT)
+        source.set_callback(dispatch)
+        source.attach(self._context)
+
+    def run_sync(self, func, *args):
+        """Calls func(*args) in the worker thread and blocks until it
+        returned. Returns its result or raises its exception."""
+        if threading.current_thread() is self._thread:
+            return func(*args)
+
+        done = threading.Event()
+        result = [None, None]
+
+        def call():
+            try:
+                result[0] = func(*args)
+            except BaseException as e:
+                result[1] = e
+            done.set()
+
+        self.invoke(call)
+        done.wait()
+        if result[1] is not None:
+            raise result[1]
+        return result[0]
+
+
+_worker = None
+if os.environ.get("PIPER_RATBAGD_THREAD") == "1":
+    use_worker_thread()
+
+
+class _RatbagdWriteQueue(object):
+    """Coalesces bursts of writes, e.g. from a spinbutton being held down.
+    Writes are keyed by (object path, method) and only the most recent
+    value of each key is kept. A key is sent once no new value arrived
+    for QUIET_PERIOD ms.
+
+    Only one call per object is in flight at any time, since different
+    methods on the same object may depend on each other's order (e.g.
+    SetButtonMapping and SetSpecialMapping). Writes to a busy object are
+    sent in the order they were added as soon as its call completes.
+    """
+
+    QUIET_PERIOD = 100
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._timeouts = {}
+        # Maps the object path to the key of its call in flight
+        self._in_flight = {}
+        self._flush_callbacks = []
+
+    def add(self, obj, method, type, value, properties, callback):
+        objpath = obj._proxy.get_object_path()
+        key = (objpath, method)
+
+        # Send any other pending write to this object first, so it can't
+        # overtake this one. If the object is busy they wait in order.
+        for other in list(self._pending):
+            if other[0] == objpath and other != key:
+                self._send(other)
+
+        callbacks = []
+        if key in self._pending:
+            callbacks = self._pending[key][4]
+            self._pending.move_to_end(key)
+        if callback is not None:
+            callbacks.append(callback)
+        self._pending[key] = (obj, type, value, properties, callbacks)
+
+        source = self._timeouts.pop(key, None)
+        if source is not None:
+            GLib.source_remove(source)
+        self._timeouts[key] = GLib.timeout_add(self.QUIET_PERIOD,
+                                               self._on_quiet_period, key)
+
+    def flush(self, callback=None):
+        if callback is not None:
+            self._flush_callbacks.append(callback)
+        for key in list(self._pending):
+            self._send(key)
+        self._check_flushed()
+
+    def _on_quiet_period(self, key):
+        del self._timeouts[key]
+        self._send(key)
+        return False
+
+    def _send(self, key):
+        if key[0] in self._in_flight:
+            # Sent by _on_call_done once the object's call completes
+            return
+
+        source = self._timeouts.pop(key, None)
+        if source is not None:
+            GLib.source_remove(source)
+
+        obj, type, value, properties, callbacks = self._pending.pop(key)
+        self._in_flight[key[0]] = key
+        try:
+            obj.dbus_call_async(key[1], type, *value, properties=properties,
+                                callback=functools.partial(self._on_call_done,
+                                                           key, callbacks))
+        except (RatbagdDBusUnavailable, OverflowError, TypeError, ValueError) as e:
+            # The call never went out, e.g. the value doesn't fit its D-Bus
+            # type. Fail it like any other call so the object isn't left
+            # busy and the callbacks still run.
+            error = GLib.Error("Failed to call {}: {}".format(key[1], e or e.__class__.__name__))
+            GLib.idle_add(self._on_call_done, key, callbacks, obj, None, error)
+
+    def _on_call_done(self, key, callbacks, obj, result, error):
+        del self._in_flight[key[0]]
+        for callback in callbacks:
+            callback(obj, result, error)
+
+        # The oldest write held back for this object goes next
+        for other in self._pending:
+            if other[0] == key[0]:
+                self._send(other)
+                break
+        self._check_flushed()
+
+    def _check_flushed(self):
+        if self._in_flight or not self._flush_callbacks:
+            return
+        # A flush is only complete once nothing is in flight anymore, any
+        # writes added in the meantime are held back normally
+        callbacks, self._flush_callbacks = self._flush_callbacks, []
+        for callback in callbacks:
+            callback()
+
+
 class _RatbagdDBus(GObject.GObject):
-    def __init__(self, interface, object_path):
+    _proxy_count = 0
+    _async_proxy_count = 0
+    _write_queue = _RatbagdWriteQueue()
+
+    # Maps the D-Bus property names to the (attribute, GObject property)
+    # pair caching them. Updated from PropertiesChanged.
+    _PROPERTIES = {}
+
+    def __init__(self, interface, object_path, proxies=None):
         GObject.GObject.__init__(self)
 
-        self._dbus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
-        if self._dbus is None:
+        # Proxies created ahead of time by the _RatbagdTreeLoader (or
+        # restored from a snapshot), keyed by object path. Handed down to
+        # our children so they don't have to create their own.
+        self._proxies = proxies
+        self._proxy_handlers = []
+        if proxies is not None and object_path in proxies:
+            self._proxy = proxies[object_path]
+        elif _worker is not None:
+            # Only the proxy is created in the worker, it must not touch
+            # our GObjects
+            self._dbus, self._proxy = _worker.run_sync(self._new_proxy, interface, object_path)
+        else:
+            self._dbus, self._proxy = self._new_proxy(interface, object_path)
+
+        if self._proxy.get_name_owner() is None:
             raise RatbagdDBusUnavailable()
 
-        try:
-            self._proxy = Gio.DBusProxy.new_sync(self._dbus,
-                                                 Gio.DBusProxyFlags.NONE,
-                                                 None,
-                                                 "org.freedesktop.ratbag1",
-                                                 object_path,
-                                                 "org.freedesktop.ratbag1.{}".format(interface),
-                                                 None)
-        except GLib.GError:
+        self._connect_proxy("g-properties-changed", self._on_properties_changed)
+
+    @staticmethod
+    def _new_proxy(interface, object_path):
+        """Returns the (connection, proxy) pair for the given object."""
+        dbus = Gio.bus_get_sync(_BUS_TYPE, None)
+        if dbus is None:
             raise RatbagdDBusUnavailable()
 
-        if self._proxy.get_name_owner() is None:
+        _RatbagdDBus._proxy_count += 1
+        start = time.monotonic()
+        try:
+            proxy = Gio.DBusProxy.new_sync(dbus,
+                                           Gio.DBusProxyFlags.NONE,
+                                           None,
+                                           "org.freedesktop.ratbag1",
+                                           object_path,
+                                           "org.freedesktop.ratbag1.{}".format(interface),
+                                           None)
+        except GLib.GError as e:
+            if _tracer is not None:
+                _tracer.record("new_sync:{}".format(interface), object_path, 0, start, e)
             raise RatbagdDBusUnavailable()
+        if _tracer is not None:
+            _tracer.record("new_sync:{}".format(interface), object_path, 0, start)
+        return dbus, proxy
+
+    def _connect_proxy(self, signal, handler):
+        """Connects to a signal of our proxy. The handler is moved over if
+        the proxy is replaced, see _attach(). With a worker thread the
+        proxy emits its signals there, the handler is run from the main
+        context instead."""
+        if _worker is not None:
+            handler_id = self._proxy.connect(signal, functools.partial(_run_in_main, handler))
+        else:
+            handler_id = self._proxy.connect(signal, handler)
+        self._proxy_handlers.append((signal, handler, handler_id))
+
+    def _child_lists(self):
+        """Returns the (D-Bus property, attribute) pairs of the lists of
+        child objects, e.g. ("Profiles", "_profiles") for a device."""
+        return [(prop, "_" + prop.lower())
+                for prop, interface in _RatbagdTreeLoader._CHILDREN.get(self._INTERFACE, [])]
+
+    def _matches(self, proxies, object_path):
+        """Returns True if the tree of proxies starting at object_path has
+        as many children of each kind as this object."""
+        proxy = proxies.get(object_path)
+        if proxy is None:
+            return False
+        for prop, attr in self._child_lists():
+            p = proxy.get_cached_property(prop)
+            paths = p.unpack() if p is not None else []
+            children = getattr(self, attr)
+            if len(paths) != len(children):
+                return False
+            for child, path in zip(children, paths):
+                if not child._matches(proxies, path):
+                    return False
+        return True
+
+    def _attach(self, proxies, object_path):
+        """Replaces the proxy of this object and its children with the
+        given ones and updates every cached property that differs, emitting
+        notify:: for those. The object keeps its object path as identity,
+        only the proxies refer to the new one. See _matches()."""
+        old = self._proxy
+        self._proxy = proxies[object_path]
+        handlers = self._proxy_handlers
+        self._proxy_handlers = []
+        for signal, handler, handler_id in handlers:
+            old.disconnect(handler_id)
+            self._connect_proxy(signal, handler)
+
+        properties = {}
+        for name in self._PROPERTIES:
+            p = self._proxy.get_cached_property(name)
+            if p is not None:
+                properties[name] = p.unpack()
+        self._update_properties(properties)
+
+        for prop, attr in self._child_lists():
+            p = self._proxy.get_cached_property(prop)
+            paths = p.unpack() if p is not None else []
+            for child, path in zip(getattr(self, attr), paths):
+                child._attach(proxies, path)
+
+    def _snapshot(self, objects):
+        """Adds the cached D-Bus properties of this object and its children
+        to the objects dict, keyed by object path, in GVariant text
+        format."""
+        objects[self._proxy.get_object_path()] = {
+            name: self._proxy.get_cached_property(name).print_(True)
+            for name in self._proxy.get_cached_property_names()
+        }
+        for prop, attr in self._child_lists():
+            for child in getattr(self, attr):
+                child._snapshot(objects)
+
+    def _on_properties_changed(self, proxy, changed_props, invalidated_props):
+        self.freeze_notify()
+        for name, value in changed_props.unpack().items():
+            if name in self._PROPERTIES:
+                self._update_property(name, value)
+        self.thaw_notify()
+
+    def _update_property(self, name, value):
+        """Updates the cached value of the given D-Bus property and emits
+        notify:: for the matching GObject property if the value changed."""
+        attr, prop = self._PROPERTIES[name]
+        if getattr(self, attr) == value:
+            return
+        setattr(self, attr, value)
+        self.notify(prop)
 
     def dbus_property(self, property):
-        p = self._proxy.get_cached_property(property)
+        if _tracer is not None:
+            start = time.monotonic()
+            p = self._proxy.get_cached_property(property)
+            _tracer.record("property:{}".format(property), self._proxy.get_object_path(),
+                           p.get_size() if p is not None else 0, start)
+        else:
+            p = self._proxy.get_cached_property(property)
         if p is not None:
             return p.unpack()
         return p
 
-    def dbus_call(self, method, type, *value):
+    def _update_properties(self, properties):
+        self.freeze_notify()
+        for name, value in properties.items():
+            self._update_property(name, value)
+        self.thaw_notify()
+
+    def dbus_call(self, method, type, *value, properties=None):
+        """Calls the given D-Bus method and blocks until it returns.
+
+        @param properties A dict of the D-Bus property values this call sets,
+                          applied to the property cache on success
+        """
         val = GLib.Variant("({})".format(type), value)
-        res = self._proxy.call_sync(method, val,
-                                    Gio.DBusCallFlags.NO_AUTO_START, 500, None)
+        if _worker is not None:
+            res = _worker.run_sync(self._call_sync, method, val)
+        else:
+            res = self._call_sync(method, val)
+        if properties:
+            self._update_properties(properties)
         if res is not None:
             return res.unpack()
         return res
 
+    def _call_sync(self, method, val):
+        if _tracer is None:
+            return self._proxy.call_sync(method, val,
+                                         Gio.DBusCallFlags.NO_AUTO_START, 500, None)
+
+        start = time.monotonic()
+        try:
+            res = self._proxy.call_sync(method, val,
+                                        Gio.DBusCallFlags.NO_AUTO_START, 500, None)
+        except GLib.GError as e:
+            _tracer.record(method, self._proxy.get_object_path(), val.get_size(), start, e)
+            raise
+        _tracer.record(method, self._proxy.get_object_path(), val.get_size(), start)
+        return res
+
+    def dbus_call_async(self, method, type, *value, properties=None,
+                        callback=None, coalesce=False):
+        """Calls the given D-Bus method without blocking. Once the call
+        completes, callback(self, result, error) is invoked from the main
+        loop, with error set to the GLib.GError if the call failed.
+
+        @param properties A dict of the D-Bus property values this call sets,
+                          applied to the property cache on success
+        @param callback The function to call on completion, or None
+        @param coalesce True to hold the call back until no other call of
+                        the same method on this object follows for a short
+                        while, only the most recent one is sent. See
+                        flush_writes().
+        """
+        if coalesce:
+            self._write_queue.add(self, method, type, value, properties, callback)
+            return
+
+        val = GLib.Variant("({})".format(type), value)
+        trace = None
+        if _tracer is not None:
+            trace = (method, val.get_size(), time.monotonic())
+        # No short timeout here, a slow device doesn't block anything
+        args = (method, val, Gio.DBusCallFlags.NO_AUTO_START, -1,
+                None, self._on_dbus_call_done, (properties, callback, trace))
+        if _worker is not None and not isinstance(self._proxy, _RatbagdSnapshotProxy):
+            _worker.invoke(self._proxy.call, *args)
+        else:
+            self._proxy.call(*args)
+
+    def _on_dbus_call_done(self, proxy, result, data):
+        properties, callback, trace = data
+        res, error = None, None
+        try:
+            res = proxy.call_finish(result)
+        except GLib.GError as e:
+            error = e
+
+        if trace is not None and _tracer is not None:
+            method, size, start = trace
+            _tracer.record(method, proxy.get_object_path(), size, start, error)
+
+        if _worker is not None:
+            _run_in_main(self._on_dbus_call_result, res, error, properties, callback)
+        else:
+            self._on_dbus_call_result(res, error, properties, callback)
+
+    def _on_dbus_call_result(self, res, error, properties, callback):
+        if error is None:
+            if properties:
+                self._update_properties(properties)
+            if res is not None:
+                res = res.unpack()
+        if callback is not None:
+            callback(self, res, error)
+
+
+class _RatbagdLazyList(Sequence):
+    """A read-only list of ratbagd objects. Each object is only created
+    (along with its D-Bus proxy) when it is first accessed and the same
+    object is returned on subsequent accesses.
+    """
+
+    def __init__(self, cls, object_paths, proxies=None):
+        self._cls = cls
+        self._objpaths = list(object_paths)
+        self._proxies = proxies
+        self._objects = [None] * len(self._objpaths)
+
+    def __len__(self):
+        return len(self._objpaths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        obj = self._objects[index]
+        if obj is None:
+            obj = self._cls(self._objpaths[index], self._proxies)
+            self._objects[index] = obj
+        return obj
+
+    def load_async(self, index, callback, *user_data):
+        """Asynchronously create the object at the given index along with
+        all of its children, see Ratbagd.new_async(). Once done,
+        callback(obj, *user_data) is invoked with the object, or None if it
+        could not be created. Subsequent accesses return the same object.
+
+        @param index The index of the object to load, as int
+        @param callback The function to call with the object
+        """
+        obj = self._objects[index]
+        if obj is not None:
+            callback(obj, *user_data)
+            return
+
+        def on_loaded(obj):
+            if obj is not None and self._objects[index] is None:
+                self._objects[index] = obj
+            callback(self._objects[index], *user_data)
+
+        objpath = self._objpaths[index]
+        _RatbagdTreeLoader(self._cls._INTERFACE, objpath,
+                           lambda proxies: self._cls(objpath, proxies),
+                           on_loaded).start()
+
+    def __repr__(self):
+        created = len(self) - self._objects.count(None)
+        return "<{} of {} ({} created)>".format(type(self).__name__,
+                                                self._cls.__name__, created)
+
+
+class _RatbagdTreeLoader(object):
+    """Creates the proxies for a ratbagd object and all its children
+    asynchronously. A proxy creation is started as soon as its object path
+    is known, i.e. all devices are requested at once, all profiles of a
+    device are requested at once as soon as that device's proxy is
+    available, and so on. Once every proxy is available, the object tree
+    is constructed from those proxies without any further round trips.
+    """
+
+    # The properties of each interface that list the object paths of its
+    # children, and the interface of those children.
+    _CHILDREN = {
+        "Manager": [("Devices", "Device")],
+        "Device": [("Profiles", "Profile")],
+        "Profile": [("Resolutions", "Resolution"),
+                    ("Buttons", "Button"),
+                    ("Leds", "Led")],
+    }
+
+    def __init__(self, interface, object_path, factory, callback,
+                 user_data=(), recursive=True):
+        """
+        @param factory Called with the dict of proxies to create the object
+        @param recursive False to only create the proxy of the object itself
+        """
+        self._interface = interface
+        self._object_path = object_path
+        self._factory = factory
+        self._callback = callback
+        self._user_data = user_data
+        self._recursive = recursive
+        self._dbus = None
+        self._proxies = {}
+        self._pending = 0
+        self._failed = False
+
+    def start(self):
+        if _worker is not None:
+            _worker.invoke(Gio.bus_get, _BUS_TYPE, None, self._on_bus_ready, None)
+        else:
+            Gio.bus_get(_BUS_TYPE, None, self._on_bus_ready, None)
+
+    def _on_bus_ready(self, source, result, data):
+        try:
+            self._dbus = Gio.bus_get_finish(result)
+        except GLib.GError:
+            self._dbus = None
+
+        if self._dbus is None:
+            self._finish()
+            return
+
+        self._new_proxy(self._interface, self._object_path)
+
+    def _new_proxy(self, interface, object_path):
+        self._pending += 1
+        _RatbagdDBus._proxy_count += 1
+        _RatbagdDBus._async_proxy_count += 1
+        start = time.monotonic() if _tracer is not None else None
+        Gio.DBusProxy.new(self._dbus,
+                          Gio.DBusProxyFlags.NONE,
+                          None,
+                          "org.freedesktop.ratbag1",
+                          object_path,
+                          "org.freedesktop.ratbag1.{}".format(interface),
+                          None,
+                          self._on_proxy_ready,
+                          (interface, object_path, start))
+
+    def _on_proxy_ready(self, source, result, data):
+        interface, object_path, start = data
+        self._pending -= 1
+
+        error = None
+        try:
+            proxy = Gio.DBusProxy.new_finish(result)
+        except GLib.GError as e:
+            proxy, error = None, e
+
+        if start is not None and _tracer is not None:
+            _tracer.record("new:{}".format(interface), object_path, 0, start, error)
+
+        if proxy is None or proxy.get_name_owner() is None:
+            self._failed = True
+        else:
+            self._proxies[object_path] = proxy
+            children = self._CHILDREN.get(interface, []) if self._recursive else []
+            for property, child_interface in children:
+                p = proxy.get_cached_property(property)
+                if p is None:
+                    continue
+                for child_path in p.unpack():
+                    self._new_proxy(child_interface, child_path)
+
+        if self._pending == 0:
+            self._finish()
+
+    def _finish(self):
+        # The factory creates our GObjects, they belong to the main thread
+        if _worker is not None:
+            _run_in_main(self._create)
+        else:
+            self._create()
+
+    def _create(self):
+        obj = None
+        if self._dbus is not None and not self._failed:
+            try:
+                obj = self._factory(self._proxies)
+            except RatbagdDBusUnavailable:
+                obj = None
+        self._callback(obj, *self._user_data)
+
+
+class _RatbagdSnapshotProxy(object):
+    """Stands in for the Gio.DBusProxy of an object restored from a
+    snapshot, see RatbagdDevice.from_snapshot(). It only has the cached
+    properties, calling a method raises RatbagdDBusUnavailable.
+    """
+
+    def __init__(self, object_path, properties):
+        self._object_path = object_path
+        self._properties = properties
+
+    def get_object_path(self):
+        return self._object_path
+
+    def get_name_owner(self):
+        return ":snapshot"
+
+    def get_cached_property(self, name):
+        return self._properties.get(name)
+
+    def get_cached_property_names(self):
+        return list(self._properties)
+
+    def connect(self, signal, handler, *args):
+        return 0
+
+    def disconnect(self, handler_id):
+        pass
+
+    def call_sync(self, *args):
+        raise RatbagdDBusUnavailable()
+
+    def call(self, *args):
+        raise RatbagdDBusUnavailable()
+
+
+class RatbagdChangeSet(GObject.GObject):
+    """A set of changes to ratbagd objects that are not written to the
+    device yet. Changes are staged with set() and read back with get(),
+    which falls back to the device's value for anything not staged.
+    commit() writes all staged changes in one batch of pipelined D-Bus
+    calls, reset() drops them without touching the device.
+
+    Changes are keyed by object and property, e.g.
+        changes.set(resolution, "resolution", (800, 800))
+        changes.set(button, "special", "wheel-up")
+    and are written through the object's set_<property>_async() method.
+
+    The "changed" signal is emitted with the object and property name
+    whenever the value get() returns for them changes, so views only need
+    to update what is affected.
+    """
+
+    # Staging one of these on a button replaces the others since a button
+    # can only have one action, the value is the resulting action type
+    _BUTTON_ACTIONS = {
+        "button_mapping": "button",
+        "special": "special",
+        "key": "key",
+        "macro": "macro",
+    }
+
+    __gsignals__ = {
+        "changed":
+            (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [object, str]),
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+        self._changes = OrderedDict()
+
+    @GObject.Property(type=bool, default=False)
+    def dirty(self):
+        """True if there are staged changes not yet written to the
+        device."""
+        return len(self._changes) > 0
+
+    def set(self, obj, prop, value):
+        """Stage the given value for the property of a ratbagd object.
+        Staging the value the device already has drops any staged change
+        for that property instead.
+
+        @param obj The RatbagdResolution, RatbagdButton or RatbagdLed
+        @param prop The property name, as str
+        @param value The new value
+        """
+        dirty = self.dirty
+
+        affected = [prop]
+        if prop in self._BUTTON_ACTIONS:
+            affected = list(self._BUTTON_ACTIONS) + ["action_type"]
+        before = [self.get(obj, p) for p in affected]
+
+        if prop in self._BUTTON_ACTIONS:
+            for other in self._BUTTON_ACTIONS:
+                self._changes.pop((obj._objpath, other), None)
+
+        unchanged = getattr(obj, prop) == value
+        if prop in self._BUTTON_ACTIONS:
+            unchanged = unchanged and obj.action_type == self._BUTTON_ACTIONS[prop]
+
+        key = (obj._objpath, prop)
+        self._changes.pop(key, None)
+        if not unchanged:
+            self._changes[key] = (obj, prop, value)
+
+        if dirty != self.dirty:
+            self.notify("dirty")
+        for p, old in zip(affected, before):
+            if self.get(obj, p) != old:
+                self.emit("changed", obj, p)
+
+    def get(self, obj, prop):
+        """Returns the staged value for the property of a ratbagd object or
+        the device's value if none is staged.
+
+        @param obj The ratbagd object
+        @param prop The property name, as str
+        """
+        change = self._changes.get((obj._objpath, prop))
+        if change is not None:
+            return change[2]
+
+        if prop == "action_type":
+            for action, action_type in self._BUTTON_ACTIONS.items():
+                if (obj._objpath, action) in self._changes:
+                    return action_type
+        return getattr(obj, prop)
+
+    def reset(self):
+        """Drop all staged changes, without re-reading the device."""
+        dirty = self.dirty
+        changes = list(self._changes.values())
+        self._changes.clear()
+        if dirty:
+            self.notify("dirty")
+        for obj, prop, value in changes:
+            self.emit("changed", obj, prop)
+            if prop in self._BUTTON_ACTIONS:
+                self.emit("changed", obj, "action_type")
+
+    def commit(self, callback=None):
+        """Write all staged changes to the device. All calls are sent at
+        once without waiting for each other. Once all of them completed,
+        callback(errors) is invoked with a list of (object, GLib.GError)
+        tuples for the calls that failed. Changes that failed to write
+        stay staged.
+
+        @param callback The function to call on completion, or None
+        """
+        errors = []
+        for key, (obj, prop, value) in list(self._changes.items()):
+            setter = getattr(obj, "set_{}_async".format(prop))
+            setter(value, functools.partial(self._on_write_done, errors, key, value))
+
+        # The setters hold their writes back for coalescing, flushing sends
+        # them all right away and tells us when they completed
+        flush_writes(None if callback is None else lambda: callback(errors))
+
+    def _on_write_done(self, errors, key, value, obj, result, error):
+        if error is not None:
+            errors.append((obj, error))
+            return
+
+        # The device has the value now, unless it was staged again meanwhile
+        change = self._changes.get(key)
+        if change is not None and change[2] == value:
+            del self._changes[key]
+            if not self.dirty:
+                self.notify("dirty")
+
 
 class Ratbagd(_RatbagdDBus):
     """The ratbagd top-level object. Provides a list of devices available
@@ -74,6 +966,9 @@ class Ratbagd(_RatbagdDBus):
     Throws RatbagdDBusUnavailable when the DBus service is not available.
     """
 
+    _INTERFACE = "Manager"
+    _OBJECT_PATH = "/org/freedesktop/ratbag1"
+
     __gsignals__ = {
         "device-added":
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [str]),
@@ -81,13 +976,32 @@ class Ratbagd(_RatbagdDBus):
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [str]),
     }
 
-    def __init__(self):
-        _RatbagdDBus.__init__(self, "Manager", "/org/freedesktop/ratbag1")
-        self._proxy.connect("g-signal", self._on_g_signal)
-        self._devices = []
-        result = self.dbus_property("Devices")
-        if result is not None:
-            self._devices = [RatbagdDevice(objpath) for objpath in result]
+    def __init__(self, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, self._OBJECT_PATH, proxies)
+        self._connect_proxy("g-signal", self._on_g_signal)
+        self._devices = _RatbagdLazyList(RatbagdDevice,
+                                         self.dbus_property("Devices") or [],
+                                         proxies)
+
+    @staticmethod
+    def new_async(callback, *user_data, recursive=True):
+        """Asynchronously create the ratbagd top-level object and its full
+        tree of devices, profiles, resolutions, buttons and leds. All D-Bus
+        proxies are created in parallel, so this takes as long as the
+        slowest object rather than the sum of all objects.
+
+        The callback is invoked from the main loop once the tree is
+        available as callback(ratbagd, *user_data), where ratbagd is None if
+        the DBus service is not available.
+
+        @param callback The function to call with the Ratbagd object
+        @param recursive False to only create the top-level object, the
+                         devices can then be loaded individually with
+                         devices.load_async()
+        """
+        _RatbagdTreeLoader(Ratbagd._INTERFACE, Ratbagd._OBJECT_PATH,
+                           lambda proxies: Ratbagd(proxies),
+                           callback, user_data, recursive).start()
 
     def _on_g_signal(self, proxy, sender, signal, params):
         params = params.unpack()
@@ -98,7 +1012,8 @@ class Ratbagd(_RatbagdDBus):
 
     @GObject.Property
     def devices(self):
-        """A list of RatbagdDevice objects supported by ratbagd."""
+        """A list of RatbagdDevice objects supported by ratbagd. The devices
+        are created when first accessed."""
         return self._devices
 
 
@@ -118,8 +1033,21 @@ class RatbagdDevice(_RatbagdDBus):
     CAP_BUTTON_MACROS = 302
     CAP_LED = 400
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Device", object_path)
+    _INTERFACE = "Device"
+
+    SNAPSHOT_VERSION = 1
+
+    _PROPERTIES = {
+        "Id": ("_devnode", "id"),
+        "Capabilities": ("_caps", "capabilities"),
+        "Name": ("_name", "name"),
+        "Svg": ("_svg", "svg"),
+        "SvgPath": ("_svg_path", "svg-path"),
+        "ActiveProfile": ("_active_profile", "active-profile"),
+    }
+
+    def __init__(self, object_path, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, object_path, proxies)
         self._objpath = object_path
         self._devnode = self.dbus_property("Id")
         self._caps = self.dbus_property("Capabilities")
@@ -127,11 +1055,11 @@ class RatbagdDevice(_RatbagdDBus):
         self._svg = self.dbus_property("Svg")
         self._svg_path = self.dbus_property("SvgPath")
 
-        self._profiles = []
+        self._profiles = _RatbagdLazyList(RatbagdProfile, [], proxies)
         self._active_profile = -1
         result = self.dbus_property("Profiles")
         if result is not None:
-            self._profiles = [RatbagdProfile(objpath) for objpath in result]
+            self._profiles = _RatbagdLazyList(RatbagdProfile, result, proxies)
             self._active_profile = self.dbus_property("ActiveProfile")
 
     @GObject.Property
@@ -167,7 +1095,8 @@ class RatbagdDevice(_RatbagdDBus):
 
     @GObject.Property
     def profiles(self):
-        """A list of RatbagdProfile objects provided by this device."""
+        """A list of RatbagdProfile objects provided by this device. The
+        profiles are created when first accessed."""
         return self._profiles
 
     @GObject.Property
@@ -186,6 +1115,87 @@ class RatbagdDevice(_RatbagdDBus):
         """
         return self.dbus_call("GetProfileByIndex", "u", index)
 
+    def snapshot(self):
+        """Returns the cached state of this device and all of its children
+        as a dict that can be stored as JSON, see from_snapshot(). This
+        doesn't talk to ratbagd but creates all child objects."""
+        objects = {}
+        self._snapshot(objects)
+        return {
+            "version": self.SNAPSHOT_VERSION,
+            "id": self.id,
+            "name": self.name,
+            "object_path": self._proxy.get_object_path(),
+            "objects": objects,
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        """Creates a device from a dict returned by snapshot(), without
+        talking to ratbagd. All values can be read and changes can be
+        staged, but writing fails with RatbagdDBusUnavailable until the
+        live device is attached, see attach().
+
+        Raises ValueError if the snapshot is invalid.
+        """
+        if snapshot.get("version") != RatbagdDevice.SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version {}".format(snapshot.get("version")))
+        try:
+            proxies = {}
+            for path, properties in snapshot["objects"].items():
+                values = {name: GLib.Variant.parse(None, text, None, None)
+                          for name, text in properties.items()}
+                proxies[path] = _RatbagdSnapshotProxy(path, values)
+            RatbagdDevice._check_snapshot(proxies, "Device", snapshot["object_path"])
+            return RatbagdDevice(snapshot["object_path"], proxies)
+        except (KeyError, AttributeError, TypeError, GLib.GError) as e:
+            raise ValueError("Invalid snapshot: {}".format(e))
+
+    @staticmethod
+    def _check_snapshot(proxies, interface, object_path):
+        """Raises ValueError unless the object and all of its children are
+        in the snapshot. A missing one would otherwise be fetched from
+        ratbagd, blocking, or fail if ratbagd isn't running."""
+        proxy = proxies.get(object_path)
+        if proxy is None:
+            raise ValueError("Invalid snapshot: {} is missing".format(object_path))
+        for prop, child_interface in _RatbagdTreeLoader._CHILDREN.get(interface, []):
+            p = proxy.get_cached_property(prop)
+            if p is None:
+                raise ValueError("Invalid snapshot: {} lacks {}".format(object_path, prop))
+            for child_path in p.unpack():
+                RatbagdDevice._check_snapshot(proxies, child_interface, child_path)
+
+    @property
+    def is_snapshot(self):
+        """True if this device was restored from a snapshot and has no live
+        device attached yet."""
+        return isinstance(self._proxy, _RatbagdSnapshotProxy)
+
+    def attach(self, other):
+        """Makes this device, restored from a snapshot, use the D-Bus
+        proxies of other, the same device loaded from ratbagd through
+        load_async() or Ratbagd.new_async(). Only the values that differ
+        from the snapshot are updated, emitting notify:: for those.
+
+        Returns False without changing anything if the devices have a
+        different number of profiles, resolutions, buttons or leds. On
+        success, other must not be used anymore.
+
+        @param other The live RatbagdDevice
+        """
+        if other._proxies is None:
+            return False
+        path = other._proxy.get_object_path()
+        if not self._matches(other._proxies, path):
+            return False
+
+        self._attach(other._proxies, path)
+        for signal, handler, handler_id in other._proxy_handlers:
+            other._proxy.disconnect(handler_id)
+        other._proxy_handlers = []
+        return True
+
     def __eq__(self, other):
         return other and self._objpath == other._objpath
 
@@ -198,30 +1208,35 @@ class RatbagdProfile(_RatbagdDBus):
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [int]),
     }
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Profile", object_path)
-        self._proxy.connect("g-signal", self._on_g_signal)
+    _INTERFACE = "Profile"
+
+    _PROPERTIES = {
+        "Index": ("_index", "index"),
+        "ActiveResolution": ("_active_resolution_index", "active-resolution"),
+        "DefaultResolution": ("_default_resolution_index", "default-resolution"),
+    }
+
+    def __init__(self, object_path, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, object_path, proxies)
+        self._connect_proxy("g-signal", self._on_g_signal)
         self._objpath = object_path
         self._index = self.dbus_property("Index")
-        self._resolutions = []
-        self._buttons = []
-        self._leds = []
+        self._resolutions = _RatbagdLazyList(RatbagdResolution, [], proxies)
         self._active_resolution_index = -1
         self._default_resolution_index = -1
 
         result = self.dbus_property("Resolutions")
         if result is not None:
-            self._resolutions = [RatbagdResolution(objpath) for objpath in result]
+            self._resolutions = _RatbagdLazyList(RatbagdResolution, result, proxies)
             self._active_resolution_index = self.dbus_property("ActiveResolution")
             self._default_resolution_index = self.dbus_property("DefaultResolution")
 
-        result = self.dbus_property("Buttons")
-        if result is not None:
-            self._buttons = [RatbagdButton(objpath) for objpath in result]
-
-        result = self.dbus_property("Leds")
-        if result is not None:
-            self._leds = [RatbagdLed(objpath) for objpath in result]
+        self._buttons = _RatbagdLazyList(RatbagdButton,
+                                         self.dbus_property("Buttons") or [],
+                                         proxies)
+        self._leds = _RatbagdLazyList(RatbagdLed,
+                                      self.dbus_property("Leds") or [],
+                                      proxies)
 
     def _on_g_signal(self, proxy, sender, signal, params):
         params = params.unpack()
@@ -271,6 +1286,11 @@ class RatbagdProfile(_RatbagdDBus):
         """Set this profile to be the active profile."""
         return self.dbus_call("SetActive", "")
 
+    def set_active_async(self, callback=None):
+        """Set this profile to be the active profile without blocking. See
+        dbus_call_async() for the callback."""
+        self.dbus_call_async("SetActive", "", callback=callback)
+
     def get_resolution_by_index(self, index):
         """Returns the resolution found at the given index. This function
         returns a RatbagdResolution or None if no resolution was found."""
@@ -293,9 +1313,21 @@ class RatbagdResolution(_RatbagdDBus):
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [int]),
     }
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Resolution", object_path)
-        self._proxy.connect("g-signal", self._on_g_signal)
+    _INTERFACE = "Resolution"
+
+    _PROPERTIES = {
+        "Index": ("_index", "index"),
+        "Capabilities": ("_caps", "capabilities"),
+        "XResolution": ("_xres", "resolution"),
+        "YResolution": ("_yres", "resolution"),
+        "ReportRate": ("_rate", "report-rate"),
+        "MaxRes": ("_max_res", "max-res"),
+        "MinRes": ("_min_res", "min-res"),
+    }
+
+    def __init__(self, object_path, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, object_path, proxies)
+        self._connect_proxy("g-signal", self._on_g_signal)
         self._objpath = object_path
         self._index = self.dbus_property("Index")
         self._caps = self.dbus_property("Capabilities")
@@ -338,7 +1370,23 @@ class RatbagdResolution(_RatbagdDBus):
 
         @param res The new resolution, as (int, int)
         """
-        return self.dbus_call("SetResolution", "uu", *res)
+        return self.dbus_call("SetResolution", "uu", *res,
+                              properties=self._resolution_properties(res))
+
+    def set_resolution_async(self, res, callback=None):
+        """Set the x- and y-resolution without blocking. See dbus_call_async()
+        for the callback, calls in quick succession are coalesced.
+
+        @param res The new resolution, as (int, int)
+        """
+        self.dbus_call_async("SetResolution", "uu", *res,
+                             properties=self._resolution_properties(res),
+                             callback=callback,
+                             coalesce=True)
+
+    @staticmethod
+    def _resolution_properties(res):
+        return {"XResolution": res[0], "YResolution": res[1]}
 
     @GObject.Property
     def report_rate(self):
@@ -361,12 +1409,29 @@ class RatbagdResolution(_RatbagdDBus):
 
         @param rate The new report rate, as int
         """
-        return self.dbus_call("SetReportRate", "u", rate)
+        return self.dbus_call("SetReportRate", "u", rate,
+                              properties={"ReportRate": rate})
+
+    def set_report_rate_async(self, rate, callback=None):
+        """Set the report rate in Hz without blocking. See dbus_call_async()
+        for the callback, calls in quick succession are coalesced.
+
+        @param rate The new report rate, as int
+        """
+        self.dbus_call_async("SetReportRate", "u", rate,
+                             properties={"ReportRate": rate},
+                             callback=callback,
+                             coalesce=True)
 
     def set_default(self):
         """Set this resolution to be the default."""
         return self.dbus_call("SetDefault", "")
 
+    def set_default_async(self, callback=None):
+        """Set this resolution to be the default without blocking. See
+        dbus_call_async() for the callback."""
+        self.dbus_call_async("SetDefault", "", callback=callback)
+
     def __eq__(self, other):
         return self._objpath == other._objpath
 
@@ -374,14 +1439,35 @@ class RatbagdResolution(_RatbagdDBus):
 class RatbagdButton(_RatbagdDBus):
     """Represents a ratbagd button."""
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Button", object_path)
+    # The event types of a macro, see macro. Macros are not part of
+    # ratbagd's D-Bus API, only tools/ratbagd-mock.py has the Macro
+    # property and the SetMacro method. See macro_supported.
+    MACRO_KEY_PRESSED = 1
+    MACRO_KEY_RELEASED = 2
+    MACRO_WAIT = 3
+
+    _INTERFACE = "Button"
+
+    _PROPERTIES = {
+        "Index": ("_index", "index"),
+        "Type": ("_type", "button-type"),
+        "ButtonMapping": ("_button", "button-mapping"),
+        "SpecialMapping": ("_special", "special"),
+        "KeyMapping": ("_key", "key"),
+        "Macro": ("_macro", "macro"),
+        "ActionType": ("_action", "action-type"),
+        "ActionTypes": ("_types", "action-types"),
+    }
+
+    def __init__(self, object_path, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, object_path, proxies)
         self._objpath = object_path
         self._index = self.dbus_property("Index")
         self._type = self.dbus_property("Type")
         self._button = self.dbus_property("ButtonMapping")
         self._special = self.dbus_property("SpecialMapping")
         self._key = self.dbus_property("KeyMapping")
+        self._macro = self.dbus_property("Macro")
         self._action = self.dbus_property("ActionType")
         self._types = self.dbus_property("ActionTypes")
 
@@ -406,7 +1492,22 @@ class RatbagdButton(_RatbagdDBus):
 
         @param button The button to map to, as int
         """
-        return self.dbus_call("SetButtonMapping", "u", button)
+        return self.dbus_call("SetButtonMapping", "u", button,
+                              properties={"ButtonMapping": button,
+                                          "ActionType": "button"})
+
+    def set_button_mapping_async(self, button, callback=None):
+        """Set the button mapping to the given button without blocking. See
+        dbus_call_async() for the callback, calls in quick succession are
+        coalesced.
+
+        @param button The button to map to, as int
+        """
+        self.dbus_call_async("SetButtonMapping", "u", button,
+                             properties={"ButtonMapping": button,
+                                         "ActionType": "button"},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def special(self):
@@ -419,7 +1520,22 @@ class RatbagdButton(_RatbagdDBus):
 
         @param special The special entry, as str
         """
-        return self.dbus_call("SetSpecialMapping", "s", special)
+        return self.dbus_call("SetSpecialMapping", "s", special,
+                              properties={"SpecialMapping": special,
+                                          "ActionType": "special"})
+
+    def set_special_async(self, special, callback=None):
+        """Set the button mapping to the given special entry without blocking.
+        See dbus_call_async() for the callback, calls in quick succession are
+        coalesced.
+
+        @param special The special entry, as str
+        """
+        self.dbus_call_async("SetSpecialMapping", "s", special,
+                             properties={"SpecialMapping": special,
+                                         "ActionType": "special"},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def key(self):
@@ -428,13 +1544,66 @@ class RatbagdButton(_RatbagdDBus):
         return self._key
 
     @key.setter
-    def key(self, key, modifiers):
+    def key(self, keys):
         """Set the key mapping.
 
-        @param key The keycode, as int
-        @param modifiers Modifier keycodes, as [int]
+        @param keys The keycode followed by the modifier keycodes, if any,
+                    as [int]
+        """
+        return self.dbus_call("SetKeyMapping", "au", list(keys),
+                              properties={"KeyMapping": list(keys),
+                                          "ActionType": "key"})
+
+    def set_key_async(self, keys, callback=None):
+        """Set the key mapping without blocking. See dbus_call_async() for the
+        callback, calls in quick succession are coalesced.
+
+        @param keys The keycode followed by the modifier keycodes, if any,
+                    as [int]
         """
-        return self.dbus_call("SetKeyMapping", "au", [key].append(modifiers))
+        self.dbus_call_async("SetKeyMapping", "au", list(keys),
+                             properties={"KeyMapping": list(keys),
+                                         "ActionType": "key"},
+                             callback=callback,
+                             coalesce=True)
+
+    @GObject.Property
+    def macro_supported(self):
+        """True if ratbagd has the Macro property, i.e. macros can be read
+        and set."""
+        return self._macro is not None
+
+    @GObject.Property
+    def macro(self):
+        """The macro as list of (type, value) tuples, if mapped to a macro.
+        The type is one of MACRO_KEY_PRESSED and MACRO_KEY_RELEASED with a
+        keycode as value, or MACRO_WAIT with a delay in ms. Empty if
+        ratbagd doesn't support macros."""
+        if self._macro is None:
+            return []
+        return self._macro
+
+    @macro.setter
+    def macro(self, macro):
+        """Set the macro.
+
+        @param macro The macro as [(int, int)], see piper.macro.Macro
+        """
+        return self.dbus_call("SetMacro", "a(uu)", list(macro),
+                              properties={"Macro": list(macro),
+                                          "ActionType": "macro"})
+
+    def set_macro_async(self, macro, callback=None):
+        """Set the macro without blocking. See dbus_call_async() for the
+        callback, calls in quick succession are coalesced.
+
+        @param macro The macro as [(int, int)], see piper.macro.Macro
+        """
+        self.dbus_call_async("SetMacro", "a(uu)", list(macro),
+                             properties={"Macro": list(macro),
+                                         "ActionType": "macro"},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def action_type(self):
@@ -462,8 +1631,19 @@ class RatbagdLed(_RatbagdDBus):
     LED_MODE_CYCLE = 2
     LED_MODE_BREATHING = 3
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Led", object_path)
+    _INTERFACE = "Led"
+
+    _PROPERTIES = {
+        "Index": ("_index", "index"),
+        "Mode": ("_mode", "mode"),
+        "Type": ("_type", "type"),
+        "Color": ("_color", "color"),
+        "EffectRate": ("_effect_rate", "effect-rate"),
+        "Brightness": ("_brightness", "brightness"),
+    }
+
+    def __init__(self, object_path, proxies=None):
+        _RatbagdDBus.__init__(self, self._INTERFACE, object_path, proxies)
         self._objpath = object_path
         self._index = self.dbus_property("Index")
         self._mode = self.dbus_property("Mode")
@@ -490,7 +1670,21 @@ class RatbagdLed(_RatbagdDBus):
         @param mode The new mode, as one of LED_MODE_OFF, LED_MODE_ON,
                                   LED_MODE_CYCLE and LED_MODE_BREATHING.
         """
-        return self.dbus_call("SetMode", "u", mode)
+        return self.dbus_call("SetMode", "u", mode,
+                              properties={"Mode": mode})
+
+    def set_mode_async(self, mode, callback=None):
+        """Set the led's mode to the given mode without blocking. See
+        dbus_call_async() for the callback, calls in quick succession are
+        coalesced.
+
+        @param mode The new mode, as one of LED_MODE_OFF, LED_MODE_ON,
+                                  LED_MODE_CYCLE and LED_MODE_BREATHING.
+        """
+        self.dbus_call_async("SetMode", "u", mode,
+                             properties={"Mode": mode},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def type(self):
@@ -508,7 +1702,20 @@ class RatbagdLed(_RatbagdDBus):
 
         @param color An RGB color, as an integer triplet.
         """
-        return self.dbus_call("SetColor", "(uuu)", color)
+        return self.dbus_call("SetColor", "(uuu)", color,
+                              properties={"Color": tuple(color)})
+
+    def set_color_async(self, color, callback=None):
+        """Set the led color to the given color without blocking. See
+        dbus_call_async() for the callback, calls in quick succession are
+        coalesced.
+
+        @param color An RGB color, as an integer triplet.
+        """
+        self.dbus_call_async("SetColor", "(uuu)", color,
+                             properties={"Color": tuple(color)},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def effect_rate(self):
@@ -521,7 +1728,20 @@ class RatbagdLed(_RatbagdDBus):
 
         @param effect_rate The new effect rate, as int
         """
-        return self.dbus_call("SetEffectRate", "u", effect_rate)
+        return self.dbus_call("SetEffectRate", "u", effect_rate,
+                              properties={"EffectRate": effect_rate})
+
+    def set_effect_rate_async(self, effect_rate, callback=None):
+        """Set the effect rate in Hz without blocking. Allowed values range
+        from 100 to 20000. See dbus_call_async() for the callback, calls in
+        quick succession are coalesced.
+
+        @param effect_rate The new effect rate, as int
+        """
+        self.dbus_call_async("SetEffectRate", "u", effect_rate,
+                             properties={"EffectRate": effect_rate},
+                             callback=callback,
+                             coalesce=True)
 
     @GObject.Property
     def brightness(self):
@@ -534,4 +1754,17 @@ class RatbagdLed(_RatbagdDBus):
 
         @param brightness The new brightness, as int
         """
-        return self.dbus_call("SetBrightness", "i", brightness)
+        return self.dbus_call("SetBrightness", "i", brightness,
+                              properties={"Brightness": brightness})
+
+    def set_brightness_async(self, brightness, callback=None):
+        """Set the brightness without blocking. Allowed values range from 0 to
+        255. See dbus_call_async() for the callback, calls in quick succession
+        are coalesced.
+
+        @param brightness The new brightness, as int
+        """
+        self.dbus_call_async("SetBrightness", "i", brightness,
+                             properties={"Brightness": brightness},
+                             callback=callback,
+                             coalesce=True)
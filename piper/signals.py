@@ -0,0 +1,83 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from contextlib import contextmanager
+
+
+class SignalBindings(object):
+    """Owns a set of signal handler connections, so they can be blocked
+    while a widget is updated programmatically and disconnected together
+    when they aren't needed anymore. Works with any GObject.
+
+        bindings = SignalBindings()
+        bindings.connect(spinbutton, "value-changed", self.on_value_changed)
+        with bindings.blocked(spinbutton):
+            spinbutton.set_value(100)   # on_value_changed isn't called
+        bindings.disconnect_all()
+    """
+
+    def __init__(self):
+        # Maps id(obj) to (obj, [handler id]), so blocking the handlers of
+        # one object doesn't look at anyone else's. Keyed by id() since the
+        # ratbagd objects compare by object path and aren't hashable.
+        self._handlers = {}
+
+    def connect(self, obj, signal, handler, *args):
+        """Connects the handler to the object's signal, see
+        GObject.Object.connect(). Returns the handler id."""
+        handler_id = obj.connect(signal, handler, *args)
+        self._handlers.setdefault(id(obj), (obj, []))[1].append(handler_id)
+        return handler_id
+
+    def handlers(self, obj):
+        """Returns the ids of the handlers connected to the object through
+        this instance."""
+        entry = self._handlers.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            return []
+        return list(entry[1])
+
+    @contextmanager
+    def blocked(self, *objs):
+        """Blocks the handlers connected through this instance on the
+        given objects for the duration of the with block. Handlers
+        connected by anyone else are not blocked."""
+        blocked = [(obj, h) for obj in objs for h in self.handlers(obj)]
+        for obj, h in blocked:
+            obj.handler_block(h)
+        try:
+            yield
+        finally:
+            for obj, h in blocked:
+                obj.handler_unblock(h)
+
+    def disconnect_all(self):
+        """Disconnects all handlers connected through this instance."""
+        for obj, handler_ids in self._handlers.values():
+            for h in handler_ids:
+                obj.disconnect(h)
+        self._handlers = {}
+
+    def __len__(self):
+        return sum(len(handler_ids) for obj, handler_ids in self._handlers.values())
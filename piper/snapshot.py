@@ -0,0 +1,223 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Immutable plain-data copies of a ratbagd device tree. A DeviceState is
+created from the bindings in one pass and holds no GObject, proxy or
+signal connection, so it is cheap to keep around for several devices.
+States are hashable and compare by value; diff() lists the fields that
+differ between two of them, to_dict()/from_dict() convert them from and
+to plain dicts for JSON.
+
+    state = DeviceState.from_device(device)
+    print(state.profiles[0].resolutions[0].xres)
+    changed = diff(old_state, state)
+"""
+
+
+def _freeze(value):
+    """Lists (e.g. from D-Bus arrays) become tuples so states stay
+    hashable."""
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class _State(object):
+    """The base of all states. Subclasses list their fields in
+    __slots__, in order; fields in _CHILDREN hold tuples of child
+    states."""
+
+    __slots__ = ()
+    _CHILDREN = {}
+
+    def __init__(self, **fields):
+        missing = set(self.__slots__) - set(fields)
+        if missing:
+            raise TypeError("{} is missing {}".format(type(self).__name__,
+                                                      ", ".join(sorted(missing))))
+        for name, value in fields.items():
+            object.__setattr__(self, name, _freeze(value))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._key()))
+
+    def __repr__(self):
+        fields = ", ".join("{}={!r}".format(name, getattr(self, name))
+                           for name in self.__slots__ if name not in self._CHILDREN)
+        return "{}({})".format(type(self).__name__, fields)
+
+    def replace(self, **changes):
+        """Returns a copy with the given fields changed."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def to_dict(self):
+        """Returns the state as dict of plain values, lists and dicts."""
+        d = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if name in self._CHILDREN:
+                d[name] = [child.to_dict() for child in value]
+            elif isinstance(value, tuple):
+                d[name] = list(value)
+            else:
+                d[name] = value
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """Creates the state from a dict returned by to_dict(). Raises
+        KeyError or TypeError if the dict doesn't match."""
+        fields = {}
+        for name in cls.__slots__:
+            value = d[name]
+            if name in cls._CHILDREN:
+                value = tuple(cls._CHILDREN[name].from_dict(v) for v in value)
+            fields[name] = value
+        return cls(**fields)
+
+
+class ResolutionState(_State):
+    __slots__ = ("index", "capabilities", "xres", "yres", "report_rate",
+                 "min_res", "max_res")
+
+    @classmethod
+    def from_resolution(cls, resolution):
+        xres, yres = resolution.resolution
+        return cls(index=resolution.index,
+                   capabilities=resolution.capabilities,
+                   xres=xres,
+                   yres=yres,
+                   report_rate=resolution.report_rate,
+                   min_res=resolution.min_res,
+                   max_res=resolution.max_res)
+
+
+class ButtonState(_State):
+    __slots__ = ("index", "button_type", "action_type", "action_types",
+                 "button_mapping", "special", "key", "macro")
+
+    @classmethod
+    def from_button(cls, button):
+        return cls(index=button.index,
+                   button_type=button.button_type,
+                   action_type=button.action_type,
+                   action_types=button.action_types,
+                   button_mapping=button.button_mapping,
+                   special=button.special,
+                   key=button.key,
+                   macro=button.macro)
+
+
+class LedState(_State):
+    __slots__ = ("index", "type", "mode", "color", "effect_rate", "brightness")
+
+    @classmethod
+    def from_led(cls, led):
+        return cls(index=led.index,
+                   type=led.type,
+                   mode=led.mode,
+                   color=led.color,
+                   effect_rate=led.effect_rate,
+                   brightness=led.brightness)
+
+
+class ProfileState(_State):
+    """active_resolution and default_resolution are indices, -1 if there
+    is none."""
+
+    __slots__ = ("index", "active_resolution", "default_resolution",
+                 "resolutions", "buttons", "leds")
+    _CHILDREN = {
+        "resolutions": ResolutionState,
+        "buttons": ButtonState,
+        "leds": LedState,
+    }
+
+    @classmethod
+    def from_profile(cls, profile):
+        active = profile.active_resolution
+        default = profile.default_resolution
+        return cls(index=profile.index,
+                   active_resolution=active.index if active is not None else -1,
+                   default_resolution=default.index if default is not None else -1,
+                   resolutions=[ResolutionState.from_resolution(r) for r in profile.resolutions],
+                   buttons=[ButtonState.from_button(b) for b in profile.buttons],
+                   leds=[LedState.from_led(led) for led in profile.leds])
+
+
+class DeviceState(_State):
+    """active_profile is an index, -1 if there is none."""
+
+    __slots__ = ("id", "name", "svg_path", "capabilities", "active_profile",
+                 "profiles")
+    _CHILDREN = {
+        "profiles": ProfileState,
+    }
+
+    @classmethod
+    def from_device(cls, device):
+        """Copies the cached state of the RatbagdDevice and all of its
+        children. This doesn't talk to ratbagd beyond creating the child
+        objects not created yet."""
+        active = device.active_profile
+        return cls(id=device.id,
+                   name=device.name,
+                   svg_path=device.svg_path,
+                   capabilities=device.capabilities,
+                   active_profile=active.index if active is not None else -1,
+                   profiles=[ProfileState.from_profile(p) for p in device.profiles])
+
+
+def diff(old, new, path=()):
+    """Returns a list of (path, old value, new value) tuples for every
+    field that differs between the two states, e.g.
+    (("profiles", 0, "resolutions", 1, "xres"), 800, 1600). Child lists
+    of different lengths are reported as a whole."""
+    if old == new:
+        return []
+    changes = []
+    for name in old.__slots__:
+        a, b = getattr(old, name), getattr(new, name)
+        if a == b:
+            continue
+        if name in old._CHILDREN and len(a) == len(b):
+            for i, (x, y) in enumerate(zip(a, b)):
+                changes.extend(diff(x, y, path + (name, i)))
+        else:
+            changes.append((path + (name,), a, b))
+    return changes
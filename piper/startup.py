@@ -0,0 +1,105 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""A timeline of Piper's startup. Each phase calls mark() when it is done,
+recording the time since the process started. Marking is cheap enough to
+always happen, the timeline is only printed or written on request, see
+piper --profile-startup.
+"""
+
+import json
+import sys
+import time
+
+_start = time.monotonic()
+_marks = []
+_profiler = None
+
+
+def set_start(start):
+    """Sets the time.monotonic() value all phases are relative to,
+    defaults to the time this module was imported."""
+    global _start
+    _start = start
+
+
+def mark(phase):
+    """Records that the given phase is done."""
+    _marks.append((phase, time.monotonic()))
+
+
+def timeline():
+    """Returns a list of (phase, ms since start, ms since the previous
+    phase) tuples."""
+    result = []
+    previous = _start
+    for phase, t in _marks:
+        result.append((phase, (t - _start) * 1000, (t - previous) * 1000))
+        previous = t
+    return result
+
+
+def elapsed(phase):
+    """Returns the ms from the start to the given phase, or None if the
+    phase isn't marked (yet)."""
+    for name, ms, delta in timeline():
+        if name == phase:
+            return ms
+    return None
+
+
+def start_cprofile():
+    """Starts collecting a cProfile of the startup."""
+    global _profiler
+    import cProfile
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def stop_cprofile(path):
+    """Stops the cProfile started with start_cprofile() and writes the
+    stats to the given file, for use with pstats or snakeviz."""
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.disable()
+    _profiler.dump_stats(path)
+    _profiler = None
+
+
+def dump(path=None):
+    """Prints the timeline to stderr if path is None or "-". Otherwise, it
+    is written to the file as JSON so it can be compared across releases.
+    """
+    phases = timeline()
+    if path is None or path == "-":
+        for phase, ms, delta in phases:
+            print("{:9.1f} ms  +{:8.1f} ms  {}".format(ms, delta, phase), file=sys.stderr)
+        return
+
+    with open(path, "w") as f:
+        json.dump({"phases": [{"name": phase, "ms": round(ms, 3), "delta": round(delta, 3)}
+                              for phase, ms, delta in phases]},
+                  f, indent=2)
+        f.write("\n")
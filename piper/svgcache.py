@@ -0,0 +1,111 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Renders device SVGs to pixbufs in a worker thread and keeps the result
+in $XDG_CACHE_HOME/piper/svg. A cached image is keyed by the SVG's path,
+its mtime and file size and the size it was rendered at, so later
+launches only load a PNG instead of parsing the SVG."""
+
+import hashlib
+import os
+import threading
+
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, GLib
+
+
+def cache_dir():
+    return os.path.join(GLib.get_user_cache_dir(), "piper", "svg")
+
+
+def cache_path(svg_path, width, height):
+    """Returns the path of the cached rendering of the SVG at the given
+    size in pixels, or None if the SVG doesn't exist."""
+    try:
+        st = os.stat(svg_path)
+    except OSError:
+        return None
+    # One file per SVG path, the rest of the key is in the second half of
+    # the name so stale renderings of the same SVG can be found
+    prefix = hashlib.sha1(svg_path.encode("utf-8")).hexdigest()
+    key = "{}:{}:{}x{}".format(st.st_mtime_ns, st.st_size, width, height)
+    name = "{}-{}.png".format(prefix, hashlib.sha1(key.encode("utf-8")).hexdigest())
+    return os.path.join(cache_dir(), name)
+
+
+def load_async(svg_path, width, height, callback, *user_data):
+    """Loads the SVG scaled to fit the given size in pixels, preserving the
+    aspect ratio; -1 leaves a dimension unconstrained. The cached PNG is
+    used if there is one, otherwise the SVG is rendered and cached. Both
+    happen in a worker thread, callback(pixbuf, *user_data) is invoked
+    from the main loop afterwards, with pixbuf None on failure.
+    """
+    thread = threading.Thread(target=_load, daemon=True,
+                              args=(svg_path, width, height, callback, user_data))
+    thread.start()
+
+
+def _load(svg_path, width, height, callback, user_data):
+    pixbuf = None
+    path = cache_path(svg_path, width, height)
+    if path is not None and os.path.exists(path):
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+        except GLib.Error:
+            pixbuf = None
+
+    if pixbuf is None and path is not None:
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(svg_path, width, height, True)
+        except GLib.Error:
+            pixbuf = None
+        if pixbuf is not None:
+            _store(path, pixbuf)
+
+    GLib.idle_add(_deliver, callback, pixbuf, user_data)
+
+
+def _deliver(callback, pixbuf, user_data):
+    callback(pixbuf, *user_data)
+    return False
+
+
+def _store(path, pixbuf):
+    """Writes the pixbuf to the cache, replacing stale renderings of the
+    same SVG. Failing to write the cache is not an error."""
+    directory, name = os.path.split(path)
+    prefix = name.split("-")[0]
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for other in os.listdir(directory):
+            if other.startswith(prefix + "-") and other != name:
+                os.unlink(os.path.join(directory, other))
+        # Written under a temporary name first so a concurrent reader never
+        # sees a partial file
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        pixbuf.savev(tmp, "png", [], [])
+        os.rename(tmp, path)
+    except (OSError, GLib.Error):
+        pass
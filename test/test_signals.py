@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Tests piper.signals.SignalBindings, and that the button mapping
+dialog writes to the device exactly once per user action, no matter how
+often it was shown before. The dialog's handlers are driven with stub
+widgets, so no display is needed, and the writes are counted by
+tools/ratbagd-mock.py on a private session bus.
+
+    $ python3 -m unittest discover test
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, SRC_DIR)
+
+# Must be set before the bindings are imported
+os.environ["PIPER_RATBAGD_BUS"] = "session"
+
+from gi.repository import Gio, GLib, GObject
+from piper import ratbagd
+from piper.actions import ActionCatalog
+from piper.piper import DevicePage
+from piper.signals import SignalBindings
+
+
+class _Widget(GObject.Object):
+    """Stands in for a widget like the mapping dialog's spinbutton."""
+
+    __gsignals__ = {
+        "value-changed": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+    }
+
+
+class _DialogWidget(GObject.Object):
+    """Stands in for any widget of the button mapping dialog. Like the
+    real ones, it only emits a signal if a value actually changes."""
+
+    __gsignals__ = {
+        "value-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "toggled": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "clicked": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "key-press-event": (GObject.SignalFlags.RUN_LAST, bool, (object,)),
+        "key-release-event": (GObject.SignalFlags.RUN_LAST, bool, (object,)),
+    }
+
+    def __init__(self):
+        GObject.Object.__init__(self)
+        self.value = 0
+        self.active = False
+        # Called by run(), i.e. what the user does while the dialog is shown
+        self.on_run = None
+
+    def set_value(self, value):
+        if value != self.value:
+            self.value = value
+            self.emit("value-changed")
+
+    def get_value_as_int(self):
+        return int(self.value)
+
+    def set_active(self, active):
+        if active != self.active:
+            self.active = active
+            self.emit("toggled")
+
+    def get_active(self):
+        return self.active
+
+    def get_active_iter(self):
+        return None
+
+    def get_children(self):
+        return []
+
+    def run(self):
+        if self.on_run is not None:
+            self.on_run()
+        return 0
+
+    def set_label(self, label):
+        pass
+
+    def set_text(self, text):
+        pass
+
+    def set_sensitive(self, sensitive):
+        pass
+
+    def set_transient_for(self, window):
+        pass
+
+    def hide(self):
+        pass
+
+
+class _DialogBuilder(object):
+    """Stands in for the Gtk.Builder of the button mapping dialog."""
+
+    def __init__(self):
+        self._objects = {}
+
+    def get_object(self, name):
+        return self._objects.setdefault(name, _DialogWidget())
+
+
+class TestSignalBindings(unittest.TestCase):
+
+    def test_blocked(self):
+        widget = _Widget()
+        other = _Widget()
+        calls = []
+        bindings = SignalBindings()
+        bindings.connect(widget, "value-changed", lambda w, v: calls.append(v))
+        bindings.connect(other, "value-changed", lambda w, v: calls.append(-v))
+        foreign = widget.connect("value-changed", lambda w, v: calls.append(v * 10))
+
+        with bindings.blocked(widget):
+            widget.emit("value-changed", 1)
+            other.emit("value-changed", 2)
+        widget.emit("value-changed", 3)
+
+        # Only our handler on the blocked object is blocked
+        self.assertEqual(calls, [10, -2, 3, 30])
+        widget.disconnect(foreign)
+
+    def test_handlers(self):
+        widget = _Widget()
+        bindings = SignalBindings()
+        self.assertEqual(bindings.handlers(widget), [])
+        h1 = bindings.connect(widget, "value-changed", lambda w, v: None)
+        h2 = bindings.connect(widget, "notify", lambda w, p: None)
+        bindings.connect(_Widget(), "value-changed", lambda w, v: None)
+        self.assertEqual(bindings.handlers(widget), [h1, h2])
+        self.assertEqual(len(bindings), 3)
+
+    def test_disconnect_all(self):
+        widget = _Widget()
+        calls = []
+        bindings = SignalBindings()
+        for i in range(5):
+            bindings.connect(widget, "value-changed", lambda w, v: calls.append(v))
+            bindings.disconnect_all()
+        bindings.connect(widget, "value-changed", lambda w, v: calls.append(v))
+        widget.emit("value-changed", 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(len(bindings), 1)
+
+
+def _wait_for_name(timeout):
+    bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = bus.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                               "org.freedesktop.DBus", "NameHasOwner",
+                               GLib.Variant("(s)", ("org.freedesktop.ratbag1",)),
+                               None, Gio.DBusCallFlags.NONE, -1, None)
+        if result.unpack()[0]:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@unittest.skipIf(shutil.which("dbus-daemon") is None, "needs dbus-daemon")
+class TestWritesPerAction(unittest.TestCase):
+    """Shows the button mapping dialog of DevicePage several times and
+    counts the writes the mock ratbagd receives."""
+
+    def setUp(self):
+        self.bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+        self.bus.up()
+        self.mock = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "tools", "ratbagd-mock.py"),
+                                      "--devices", "1", "--profiles", "1"],
+                                     env=dict(os.environ,
+                                              DBUS_SESSION_BUS_ADDRESS=self.bus.get_bus_address()),
+                                     stderr=subprocess.PIPE,
+                                     universal_newlines=True)
+        if not _wait_for_name(5):
+            self.tearDown()
+            self.fail("The mock ratbagd didn't show up on the bus")
+
+    def tearDown(self):
+        if self.mock is not None:
+            self.mock.terminate()
+            self.stats = self.mock.communicate()[1]
+            self.mock = None
+        if self.bus is not None:
+            self.bus.down()
+            self.bus = None
+
+    def _calls(self, method):
+        """Stops the mock and returns how often the method was called."""
+        self.tearDown()
+        m = re.search(r"^\s*{}: (\d+)$".format(method), self.stats, re.MULTILINE)
+        return int(m.group(1)) if m is not None else 0
+
+    def _commit(self, changes):
+        loop = GLib.MainLoop()
+        errors = []
+
+        def on_committed(commit_errors):
+            errors.extend(commit_errors)
+            loop.quit()
+
+        changes.commit(on_committed)
+        loop.run()
+        self.assertEqual(errors, [])
+
+    def test_one_write_per_action(self):
+        button = ratbagd.Ratbagd().devices[0].profiles[0].buttons[0]
+        changes = ratbagd.RatbagdChangeSet()
+
+        # Only what _show_btnmap_dialog() and its handlers use
+        builder = _DialogBuilder()
+        page = DevicePage.__new__(DevicePage)
+        page._window = None
+        page._dialog_builder = builder
+        page._changes = changes
+        page._actions = ActionCatalog()
+        dialog = builder.get_object("piper-btnmap-dialog")
+        spinbutton = builder.get_object("piper-btnmap-btnmap-spinbutton")
+
+        actions = 5
+        for i in range(actions):
+            def on_run():
+                # Showing the dialog fills in the button's current mapping,
+                # which must not stage anything
+                self.assertFalse(changes.dirty)
+                # The user picks another button, then closes the dialog
+                spinbutton.set_value(10 + i)
+
+            dialog.on_run = on_run
+            page._show_btnmap_dialog(button)
+            self.assertTrue(changes.dirty)
+            self._commit(changes)
+
+        self.assertEqual(button.button_mapping, 10 + actions - 1)
+        self.assertEqual(self._calls("SetButtonMapping"), actions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Generates piper/keycodes.py from the kernel's input-event-codes.h, so
+piper looks up key names in plain dicts instead of parsing the header at
+runtime. Run by meson at build time; to run piper from the source tree:
+
+    $ tools/gen-keycodes.py /usr/include/linux/input-event-codes.h piper/keycodes.py
+"""
+
+import argparse
+import re
+import sys
+
+# The modifier keys, in the order they are listed after the key of a key
+# mapping
+MODIFIERS = [
+    "KEY_LEFTCTRL",
+    "KEY_RIGHTCTRL",
+    "KEY_LEFTSHIFT",
+    "KEY_RIGHTSHIFT",
+    "KEY_LEFTALT",
+    "KEY_RIGHTALT",
+    "KEY_LEFTMETA",
+    "KEY_RIGHTMETA",
+]
+
+# Defines that are limits rather than keys
+SKIP = ["KEY_MAX", "BTN_MISC", "BTN_MOUSE", "BTN_JOYSTICK", "BTN_GAMEPAD",
+        "BTN_DIGI", "BTN_WHEEL", "BTN_TRIGGER_HAPPY"]
+
+HEADER = '''# Generated by tools/gen-keycodes.py from {source}, do not edit.
+
+"""The KEY_ and BTN_ codes of the kernel, see piper.actions.ActionCatalog.
+KEYCODES maps names to keycodes, KEYNAMES keycodes to names (the first
+name for codes with several) and MODIFIERS lists the keycodes of the
+modifier keys, in the order they follow the key of a key mapping."""
+'''
+
+
+def parse(path):
+    """Returns the (name, code) pairs of the KEY_ and BTN_ defines of the
+    header, in the order they are defined."""
+    define = re.compile(r"^#define\s+((?:KEY|BTN)_\w+)\s+(0x[0-9a-fA-F]+|\d+)")
+    codes = []
+    with open(path) as f:
+        for line in f:
+            m = define.match(line)
+            if m is not None and m.group(1) not in SKIP:
+                codes.append((m.group(1), int(m.group(2), 0)))
+    return codes
+
+
+def generate(codes, source):
+    keycodes = dict(codes)
+    missing = [name for name in MODIFIERS if name not in keycodes]
+    if missing:
+        raise ValueError("{} lacks {}".format(source, ", ".join(missing)))
+
+    keynames = {}
+    for name, code in codes:
+        keynames.setdefault(code, name)
+
+    lines = [HEADER.format(source=source), "KEYCODES = {"]
+    lines += ['    "{}": {},'.format(name, code) for name, code in codes]
+    lines += ["}", "", "KEYNAMES = {"]
+    lines += ['    {}: "{}",'.format(code, name) for code, name in sorted(keynames.items())]
+    lines += ["}", "", "MODIFIERS = ("]
+    lines += ["    {},  # {}".format(keycodes[name], name) for name in MODIFIERS]
+    lines += [")", ""]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate piper/keycodes.py")
+    parser.add_argument("header", help="The path to input-event-codes.h")
+    parser.add_argument("output", help="The Python module to write")
+    args = parser.parse_args()
+
+    try:
+        module = generate(parse(args.header), "input-event-codes.h")
+    except (OSError, ValueError) as e:
+        print("Failed to generate the keycodes: {}".format(e), file=sys.stderr)
+        return 1
+
+    with open(args.output, "w") as f:
+        f.write(module)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
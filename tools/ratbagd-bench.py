@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Benchmarks the ratbagd bindings against tools/ratbagd-mock.py on a
+private session bus, so it runs without hardware and without touching the
+system's ratbagd:
+
+    $ tools/ratbagd-bench.py --profiles 5 --latency 10
+
+Each measurement is given a name, with --max NAME=MS the script exits with
+an error if that measurement took longer than MS milliseconds, e.g. to
+catch regressions in CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+
+# Must be set before the bindings are imported
+os.environ["PIPER_RATBAGD_BUS"] = "session"
+
+from gi.repository import Gio, GLib
+from piper import ratbagd
+
+
+def _wait_for_name(timeout):
+    bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = bus.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                               "org.freedesktop.DBus", "NameHasOwner",
+                               GLib.Variant("(s)", ("org.freedesktop.ratbag1",)),
+                               None, Gio.DBusCallFlags.NONE, -1, None)
+        if result.unpack()[0]:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _walk(r):
+    """Touches every object of the tree, materializing the lazy lists."""
+    for device in r.devices:
+        for profile in device.profiles:
+            list(profile.resolutions)
+            list(profile.buttons)
+            list(profile.leds)
+
+
+def bench_sync_tree():
+    r = ratbagd.Ratbagd()
+    _walk(r)
+    return r
+
+
+def bench_async_tree():
+    loop = GLib.MainLoop()
+    result = []
+
+    def on_loaded(r):
+        result.append(r)
+        loop.quit()
+
+    ratbagd.Ratbagd.new_async(on_loaded)
+    loop.run()
+    if result[0] is None:
+        raise RuntimeError("Failed to load the ratbagd tree")
+    _walk(result[0])
+    return result[0]
+
+
+def bench_write_burst(r, count=100):
+    """A burst of resolution writes like dragging a slider, coalesced into
+    a few calls."""
+    loop = GLib.MainLoop()
+    resolution = r.devices[0].profiles[0].resolutions[0]
+    for i in range(count):
+        res = 200 + 50 * i
+        resolution.set_resolution_async((res, res))
+    ratbagd.flush_writes(loop.quit)
+    loop.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ratbagd bindings against the mock ratbagd")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--resolutions", type=int, default=5)
+    parser.add_argument("--buttons", type=int, default=12)
+    parser.add_argument("--leds", type=int, default=3)
+    parser.add_argument("--latency", type=int, default=0,
+                        help="Per-call latency of the mock in ms")
+    parser.add_argument("--max", action="append", default=[], metavar="NAME=MS",
+                        help="Fail if the named measurement takes longer than MS")
+    args = parser.parse_args()
+
+    limits = {}
+    for limit in args.max:
+        name, ms = limit.split("=")
+        limits[name] = float(ms)
+
+    bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+    bus.up()
+    mock = subprocess.Popen([sys.executable, os.path.join(TOOLS_DIR, "ratbagd-mock.py"),
+                             "--devices", str(args.devices),
+                             "--profiles", str(args.profiles),
+                             "--resolutions", str(args.resolutions),
+                             "--buttons", str(args.buttons),
+                             "--leds", str(args.leds),
+                             "--latency", str(args.latency)],
+                            env=dict(os.environ,
+                                     DBUS_SESSION_BUS_ADDRESS=bus.get_bus_address()))
+    failed = []
+    try:
+        if not _wait_for_name(5):
+            print("The mock ratbagd didn't show up on the bus", file=sys.stderr)
+            return 1
+
+        r = None
+        for name, func in (("sync-tree", bench_sync_tree),
+                           ("async-tree", bench_async_tree),
+                           ("write-burst", lambda: bench_write_burst(r))):
+            proxies = ratbagd.proxy_count()
+            async_proxies = ratbagd.async_proxy_count()
+            start = time.monotonic()
+            result = func()
+            elapsed = (time.monotonic() - start) * 1000
+            if r is None:
+                r = result
+            async_proxies = ratbagd.async_proxy_count() - async_proxies
+            print("{:12} {:8.1f} ms  {:4} sync proxies  {:4} async proxies".format(
+                name, elapsed, ratbagd.proxy_count() - proxies - async_proxies,
+                async_proxies))
+            if name in limits and elapsed > limits[name]:
+                failed.append(name)
+    finally:
+        mock.terminate()
+        mock.wait()
+        bus.down()
+
+    if failed:
+        print("Too slow: {}".format(", ".join(failed)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
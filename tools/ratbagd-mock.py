@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""A stand-in for ratbagd on the session bus, for testing and benchmarking
+Piper without any hardware. It exports the same interfaces as ratbagd, as
+far as piper/ratbagd.py uses them, for any number of fake devices.
+
+Run Piper against it with PIPER_RATBAGD_BUS=session, preferably on a
+private bus:
+
+    $ dbus-run-session -- sh -c \\
+        'tools/ratbagd-mock.py --profiles 5 --latency 20 & \\
+         sleep 1; PIPER_RATBAGD_BUS=session piper'
+
+On exit (SIGINT or SIGTERM), the number of calls per method is printed to
+stderr.
+"""
+
+import argparse
+import collections
+import signal
+import sys
+
+from gi.repository import Gio, GLib
+
+NAME = "org.freedesktop.ratbag1"
+PREFIX = "org.freedesktop.ratbag1."
+ROOT = "/org/freedesktop/ratbag1"
+
+INTROSPECTION = """
+<node>
+  <interface name="org.freedesktop.ratbag1.Manager">
+    <property name="Devices" type="ao" access="read"/>
+    <signal name="DeviceNew"><arg type="o"/></signal>
+    <signal name="DeviceRemoved"><arg type="o"/></signal>
+  </interface>
+  <interface name="org.freedesktop.ratbag1.Device">
+    <property name="Id" type="s" access="read"/>
+    <property name="Capabilities" type="au" access="read"/>
+    <property name="Name" type="s" access="read"/>
+    <property name="Svg" type="s" access="read"/>
+    <property name="SvgPath" type="s" access="read"/>
+    <property name="Profiles" type="ao" access="read"/>
+    <property name="ActiveProfile" type="u" access="read"/>
+    <method name="GetProfileByIndex">
+      <arg type="u" direction="in"/><arg type="o" direction="out"/>
+    </method>
+  </interface>
+  <interface name="org.freedesktop.ratbag1.Profile">
+    <property name="Index" type="u" access="read"/>
+    <property name="Resolutions" type="ao" access="read"/>
+    <property name="Buttons" type="ao" access="read"/>
+    <property name="Leds" type="ao" access="read"/>
+    <property name="ActiveResolution" type="u" access="read"/>
+    <property name="DefaultResolution" type="u" access="read"/>
+    <method name="SetActive"><arg type="u" direction="out"/></method>
+    <method name="GetResolutionByIndex">
+      <arg type="u" direction="in"/><arg type="o" direction="out"/>
+    </method>
+    <signal name="ActiveProfileChanged"><arg type="u"/></signal>
+  </interface>
+  <interface name="org.freedesktop.ratbag1.Resolution">
+    <property name="Index" type="u" access="read"/>
+    <property name="Capabilities" type="au" access="read"/>
+    <property name="XResolution" type="u" access="read"/>
+    <property name="YResolution" type="u" access="read"/>
+    <property name="ReportRate" type="u" access="read"/>
+    <property name="MaxRes" type="u" access="read"/>
+    <property name="MinRes" type="u" access="read"/>
+    <method name="SetResolution">
+      <arg type="u" direction="in"/><arg type="u" direction="in"/>
+      <arg type="u" direction="out"/>
+    </method>
+    <method name="SetReportRate">
+      <arg type="u" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetDefault"><arg type="u" direction="out"/></method>
+    <signal name="ActiveResolutionChanged"><arg type="u"/></signal>
+    <signal name="DefaultResolutionChanged"><arg type="u"/></signal>
+  </interface>
+  <interface name="org.freedesktop.ratbag1.Button">
+    <property name="Index" type="u" access="read"/>
+    <property name="Type" type="s" access="read"/>
+    <property name="ButtonMapping" type="u" access="read"/>
+    <property name="SpecialMapping" type="s" access="read"/>
+    <property name="KeyMapping" type="au" access="read"/>
+    <property name="Macro" type="a(uu)" access="read"/>
+    <property name="ActionType" type="s" access="read"/>
+    <property name="ActionTypes" type="as" access="read"/>
+    <method name="SetButtonMapping">
+      <arg type="u" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetSpecialMapping">
+      <arg type="s" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetKeyMapping">
+      <arg type="au" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetMacro">
+      <arg type="a(uu)" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="Disable"><arg type="u" direction="out"/></method>
+  </interface>
+  <interface name="org.freedesktop.ratbag1.Led">
+    <property name="Index" type="u" access="read"/>
+    <property name="Mode" type="u" access="read"/>
+    <property name="Type" type="s" access="read"/>
+    <property name="Color" type="(uuu)" access="read"/>
+    <property name="EffectRate" type="u" access="read"/>
+    <property name="Brightness" type="u" access="read"/>
+    <method name="SetMode">
+      <arg type="u" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetColor">
+      <arg type="(uuu)" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetEffectRate">
+      <arg type="u" direction="in"/><arg type="u" direction="out"/>
+    </method>
+    <method name="SetBrightness">
+      <arg type="i" direction="in"/><arg type="u" direction="out"/>
+    </method>
+  </interface>
+</node>
+"""
+
+
+class MockObject(object):
+    """One exported object with its properties, as GLib.Variants."""
+
+    def __init__(self, path, interface, properties):
+        self.path = path
+        self.interface = interface
+        self.properties = properties
+        self.parent = None
+
+
+class MockRatbagd(object):
+    def __init__(self, args):
+        self._args = args
+        self._node_info = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION)
+        self._objects = collections.OrderedDict()
+        self._calls = collections.Counter()
+        self._connection = None
+
+        devices = [self._add_device(i) for i in range(args.devices)]
+        self._add(ROOT, "Manager", {"Devices": GLib.Variant("ao", devices)})
+
+    def _add(self, path, interface, properties, parent=None):
+        obj = MockObject(path, interface, properties)
+        obj.parent = parent
+        self._objects[path] = obj
+        return obj
+
+    def _add_device(self, idx):
+        args = self._args
+        path = "{}/device/mock{}".format(ROOT, idx)
+        profiles = ["{}/p{}".format(path, i) for i in range(args.profiles)]
+        device = self._add(path, "Device", {
+            "Id": GLib.Variant("s", "mock{}".format(idx)),
+            "Capabilities": GLib.Variant("au", [1, 100, 101, 200, 201, 300, 301, 400]),
+            "Name": GLib.Variant("s", "Mock Mouse {}".format(idx)),
+            "Svg": GLib.Variant("s", "mock.svg"),
+            "SvgPath": GLib.Variant("s", args.svg),
+            "Profiles": GLib.Variant("ao", profiles),
+            "ActiveProfile": GLib.Variant("u", 0),
+        })
+
+        for p, ppath in enumerate(profiles):
+            resolutions = ["{}/r{}".format(ppath, i) for i in range(args.resolutions)]
+            buttons = ["{}/b{}".format(ppath, i) for i in range(args.buttons)]
+            leds = ["{}/l{}".format(ppath, i) for i in range(args.leds)]
+            profile = self._add(ppath, "Profile", {
+                "Index": GLib.Variant("u", p),
+                "Resolutions": GLib.Variant("ao", resolutions),
+                "Buttons": GLib.Variant("ao", buttons),
+                "Leds": GLib.Variant("ao", leds),
+                "ActiveResolution": GLib.Variant("u", 0),
+                "DefaultResolution": GLib.Variant("u", 0),
+            }, device)
+
+            for i, rpath in enumerate(resolutions):
+                res = 400 * (i + 1)
+                self._add(rpath, "Resolution", {
+                    "Index": GLib.Variant("u", i),
+                    "Capabilities": GLib.Variant("au", []),
+                    "XResolution": GLib.Variant("u", res),
+                    "YResolution": GLib.Variant("u", res),
+                    "ReportRate": GLib.Variant("u", 1000),
+                    "MaxRes": GLib.Variant("u", 12000),
+                    "MinRes": GLib.Variant("u", 200),
+                }, profile)
+
+            for i, bpath in enumerate(buttons):
+                self._add(bpath, "Button", {
+                    "Index": GLib.Variant("u", i),
+                    "Type": GLib.Variant("s", "unknown"),
+                    "ButtonMapping": GLib.Variant("u", i + 1),
+                    "SpecialMapping": GLib.Variant("s", "unknown"),
+                    "KeyMapping": GLib.Variant("au", [0]),
+                    "Macro": GLib.Variant("a(uu)", []),
+                    "ActionType": GLib.Variant("s", "button"),
+                    "ActionTypes": GLib.Variant("as", ["none", "button", "key", "special", "macro"]),
+                }, profile)
+
+            for i, lpath in enumerate(leds):
+                self._add(lpath, "Led", {
+                    "Index": GLib.Variant("u", i),
+                    "Mode": GLib.Variant("u", 1),
+                    "Type": GLib.Variant("s", "logo"),
+                    "Color": GLib.Variant("(uuu)", (255, 0, 0)),
+                    "EffectRate": GLib.Variant("u", 1000),
+                    "Brightness": GLib.Variant("u", 255),
+                }, profile)
+
+        return path
+
+    def run(self):
+        self._loop = GLib.MainLoop()
+        Gio.bus_own_name(Gio.BusType.SESSION, NAME,
+                         Gio.BusNameOwnerFlags.NONE,
+                         self._on_bus_acquired, None, self._on_name_lost)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, self._on_quit)
+        self._loop.run()
+        self._print_stats()
+
+    def _on_bus_acquired(self, connection, name):
+        self._connection = connection
+        for obj in self._objects.values():
+            info = self._node_info.lookup_interface(PREFIX + obj.interface)
+            # Without get/set_property handlers, property calls go through
+            # _on_method_call too so they get the same latency
+            connection.register_object(obj.path, info, self._on_method_call, None, None)
+
+    def _on_name_lost(self, connection, name):
+        print("Failed to own {} on the session bus".format(NAME), file=sys.stderr)
+        self._loop.quit()
+
+    def _on_quit(self):
+        self._loop.quit()
+        return False
+
+    def _print_stats(self):
+        print("Method calls:", file=sys.stderr)
+        for method, count in sorted(self._calls.items()):
+            print("  {}: {}".format(method, count), file=sys.stderr)
+
+    def _on_method_call(self, connection, sender, path, interface, method,
+                        params, invocation):
+        self._calls[method] += 1
+        if self._args.latency > 0:
+            GLib.timeout_add(self._args.latency, self._handle_method_call,
+                             path, interface, method, params, invocation)
+        else:
+            self._handle_method_call(path, interface, method, params, invocation)
+
+    def _handle_method_call(self, path, interface, method, params, invocation):
+        obj = self._objects[path]
+        params = params.unpack()
+
+        if interface == "org.freedesktop.DBus.Properties":
+            if method == "GetAll":
+                invocation.return_value(GLib.Variant("(a{sv})", (obj.properties,)))
+            elif method == "Get":
+                invocation.return_value(GLib.Variant("(v)", (obj.properties[params[1]],)))
+            else:
+                invocation.return_dbus_error("org.freedesktop.DBus.Error.PropertyReadOnly",
+                                             "All properties are read-only")
+            return False
+
+        handler = getattr(self, "_method_{}".format(method), None)
+        if handler is None:
+            invocation.return_dbus_error("org.freedesktop.DBus.Error.UnknownMethod",
+                                         "Unknown method {}".format(method))
+            return False
+
+        invocation.return_value(handler(obj, *params))
+        return False
+
+    def _set(self, obj, **properties):
+        changed = {}
+        for name, value in properties.items():
+            old = obj.properties[name]
+            new = GLib.Variant(old.get_type_string(), value)
+            if not old.equal(new):
+                obj.properties[name] = new
+                changed[name] = new
+        if changed:
+            self._connection.emit_signal(None, obj.path,
+                                         "org.freedesktop.DBus.Properties",
+                                         "PropertiesChanged",
+                                         GLib.Variant("(sa{sv}as)",
+                                                      (PREFIX + obj.interface, changed, [])))
+
+    def _emit(self, obj, signal, value):
+        self._connection.emit_signal(None, obj.path, PREFIX + obj.interface,
+                                     signal, GLib.Variant("(u)", (value,)))
+
+    def _method_GetProfileByIndex(self, obj, index):
+        return GLib.Variant("(o)", (obj.properties["Profiles"].unpack()[index],))
+
+    def _method_GetResolutionByIndex(self, obj, index):
+        return GLib.Variant("(o)", (obj.properties["Resolutions"].unpack()[index],))
+
+    def _method_SetActive(self, obj):
+        index = obj.properties["Index"].unpack()
+        self._set(obj.parent, ActiveProfile=index)
+        self._emit(obj, "ActiveProfileChanged", index)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetResolution(self, obj, xres, yres):
+        self._set(obj, XResolution=xres, YResolution=yres)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetReportRate(self, obj, rate):
+        self._set(obj, ReportRate=rate)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetDefault(self, obj):
+        index = obj.properties["Index"].unpack()
+        self._set(obj.parent, DefaultResolution=index)
+        self._emit(obj, "DefaultResolutionChanged", index)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetButtonMapping(self, obj, button):
+        self._set(obj, ButtonMapping=button, ActionType="button")
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetSpecialMapping(self, obj, special):
+        self._set(obj, SpecialMapping=special, ActionType="special")
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetKeyMapping(self, obj, keys):
+        self._set(obj, KeyMapping=keys, ActionType="key")
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetMacro(self, obj, macro):
+        self._set(obj, Macro=macro, ActionType="macro")
+        return GLib.Variant("(u)", (0,))
+
+    def _method_Disable(self, obj):
+        self._set(obj, ActionType="none")
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetMode(self, obj, mode):
+        self._set(obj, Mode=mode)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetColor(self, obj, color):
+        self._set(obj, Color=color)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetEffectRate(self, obj, rate):
+        self._set(obj, EffectRate=rate)
+        return GLib.Variant("(u)", (0,))
+
+    def _method_SetBrightness(self, obj, brightness):
+        self._set(obj, Brightness=brightness)
+        return GLib.Variant("(u)", (0,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A mock ratbagd on the session bus")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--resolutions", type=int, default=5)
+    parser.add_argument("--buttons", type=int, default=12)
+    parser.add_argument("--leds", type=int, default=3)
+    parser.add_argument("--latency", type=int, default=0,
+                        help="Delay every method call and property read by this many ms")
+    parser.add_argument("--svg", default="",
+                        help="The SVG path reported for the devices")
+    MockRatbagd(parser.parse_args()).run()
+
+
+if __name__ == "__main__":
+    main()